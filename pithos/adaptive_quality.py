@@ -0,0 +1,104 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from collections import deque
+
+from .pandora.pandora import AUDIO_QUALITIES
+
+# Buffer underruns within UNDERRUN_WINDOW seconds that lower the quality.
+UNDERRUN_LIMIT = 2
+UNDERRUN_WINDOW = 5*60
+# Seconds of playback without underruns before trying a higher quality.
+STABLE_PLAYBACK_TIME = 10*60
+# Throughput needed relative to a bitrate to play it without underruns.
+THROUGHPUT_HEADROOM = 1.5
+
+
+class AdaptiveQuality:
+    """Picks the audio quality from buffer underruns and download throughput
+
+    The quality steps down after repeated underruns or when downloads are
+    too slow for the current bitrate, and steps back up after stable
+    playback, never going above ceiling, the quality the user chose.
+    """
+
+    def __init__(self, ceiling):
+        self.ceiling = ceiling
+        self.quality = ceiling
+        self._underruns = deque()
+        self._stable_time = 0
+        # Last measured throughput in kbit/s
+        self._throughput = None
+
+    def set_ceiling(self, ceiling):
+        self.ceiling = ceiling
+        self.quality = ceiling
+        self._reset()
+
+    def underrun(self, now=None):
+        """Records a buffer underrun, returns whether the quality changed"""
+        now = time.monotonic() if now is None else now
+        self._stable_time = 0
+        self._underruns.append(now)
+        while self._underruns[0] < now - UNDERRUN_WINDOW:
+            self._underruns.popleft()
+        if len(self._underruns) < UNDERRUN_LIMIT:
+            return False
+        return self._step(-1, '{} buffer underruns'.format(len(self._underruns)))
+
+    def throughput(self, kbps, bitrates):
+        """Records a download's throughput, returns whether the quality changed
+
+        bitrates maps the qualities of the downloaded song to their bitrates in kbit/s.
+        """
+        self._throughput = kbps
+        bitrate = bitrates.get(self.quality)
+        if bitrate is not None and kbps < bitrate * THROUGHPUT_HEADROOM:
+            return self._step(-1, 'downloads at {:.0f} kbit/s'.format(kbps))
+        return False
+
+    def played(self, seconds, bitrates):
+        """Records playback without underruns, returns whether the quality changed
+
+        bitrates maps the qualities of the played song to their bitrates in kbit/s.
+        """
+        self._stable_time += seconds
+        if self._stable_time < STABLE_PLAYBACK_TIME or self.quality == self.ceiling:
+            return False
+        higher = self._neighbour(1)
+        bitrate = bitrates.get(higher)
+        if self._throughput is not None and bitrate is not None and self._throughput < bitrate * THROUGHPUT_HEADROOM:
+            return False
+        return self._step(1, '{} seconds of stable playback'.format(self._stable_time))
+
+    def _neighbour(self, direction):
+        if self.quality not in AUDIO_QUALITIES or self.ceiling not in AUDIO_QUALITIES:
+            return self.quality
+        index = AUDIO_QUALITIES.index(self.quality) + direction
+        index = max(0, min(index, AUDIO_QUALITIES.index(self.ceiling)))
+        return AUDIO_QUALITIES[index]
+
+    def _step(self, direction, reason):
+        quality = self._neighbour(direction)
+        self._reset()
+        if quality == self.quality:
+            return False
+        logging.info('Changing audio quality from {} to {} after {}'.format(self.quality, quality, reason))
+        self.quality = quality
+        return True
+
+    def _reset(self):
+        self._underruns.clear()
+        self._stable_time = 0
@@ -0,0 +1,259 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Album art files
+
+Art is cached by album in two variants: a thumbnail for the song list
+and the full size image whose file URL plugins get as ``Song.artUrl``.
+Decoded thumbnails are kept by :py:class:`ThumbnailCache`.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from gi.repository import GdkPixbuf, GLib
+
+from .util import JsonFileCache
+
+# Sizes Pandora's image servers render album art at, smallest first.
+ART_VARIANT_SIZES = (90, 130, 500, 640, 1080)
+
+# Pandora art URLs end in e.g. _500W_500H.jpg
+_ART_SIZE_REGEX = re.compile(r'(\d+)W_(\d+)H(\.\w+)$')
+
+ART_SUFFIX = '.jpeg'
+PIXELS_SUFFIX = '.pixels'
+INDEX_FILE = 'art_index.json'
+
+# Header of the raw pixel files: magic, width, height, rowstride, has alpha
+_PIXELS_HEADER = struct.Struct('<4sIII?')
+_PIXELS_MAGIC = b'PXB1'
+
+
+def variant_url(url, size):
+    """Returns the URL of the smallest variant of the art at url that is at least size pixels wide
+
+    Returns url itself if it isn't a resizable Pandora art URL or already small enough.
+    """
+    match = _ART_SIZE_REGEX.search(url)
+    if not match:
+        return url
+    variant = next((i for i in ART_VARIANT_SIZES if i >= size), ART_VARIANT_SIZES[-1])
+    if variant >= int(match.group(1)):
+        return url
+    return '{0}{1}W_{1}H{2}'.format(url[:match.start()], variant, match.group(3))
+
+
+def album_key(artist, album):
+    return hashlib.sha256((artist + album).encode('utf-8')).hexdigest()
+
+
+class ArtCache:
+    """Album art files in directory, keyed by :py:func:`album_key`
+
+    An index of the files' sizes and last access times is kept in the
+    directory. :py:meth:`evict` uses it to keep the cache under max_bytes
+    and to drop files unused for max_age seconds without looking at every file.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # File name -> [size, last access time]
+        self.index = JsonFileCache(os.path.join(directory, INDEX_FILE))
+        self._reconciled = False
+
+    def path(self, key, thumbnail=False, suffix=ART_SUFFIX):
+        return os.path.join(self.directory, key + ('-thumb' if thumbnail else '') + suffix)
+
+    def get(self, key, thumbnail=False, suffix=ART_SUFFIX):
+        """Returns the cached image data or None
+
+        The full size image is returned if there is no thumbnail.
+        """
+        paths = [self.path(key, suffix=suffix)]
+        if thumbnail:
+            paths.insert(0, self.path(key, thumbnail=True, suffix=suffix))
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.warning('Failed to read cached art: {}'.format(e))
+                continue
+            self.index[os.path.basename(path)] = [len(data), time.time()]
+            return data
+        return None
+
+    def put(self, key, data, thumbnail=False, suffix=ART_SUFFIX):
+        path = self.path(key, thumbnail, suffix)
+        try:
+            with open(path, 'xb') as f:
+                f.write(data)
+        except FileExistsError:
+            pass
+        except OSError:
+            logging.warning('Failed to write art tempfile')
+            return
+        self.index[os.path.basename(path)] = [len(data), time.time()]
+
+    def file_url(self, key, thumbnail=False):
+        """Returns the file URL of the image if it is cached, otherwise None"""
+        path = self.path(key, thumbnail)
+        if not os.path.exists(path):
+            return None
+        self.touch(key, thumbnail)
+        return urllib.parse.urljoin('file://', urllib.parse.quote(path))
+
+    def touch(self, key, thumbnail=False, suffix=ART_SUFFIX):
+        """Records a use of the image that didn't go through get(), so evict() keeps it"""
+        name = os.path.basename(self.path(key, thumbnail, suffix))
+        entry = self.index.get(name)
+        if entry is not None:
+            self.index[name] = [entry[0], time.time()]
+
+    def evict(self):
+        """Remove least recently used files until the cache fits max_bytes and is no older than max_age
+
+        This does file system IO, so call it from a worker thread.
+        """
+        if not self._reconciled:
+            self._reconcile()
+            self._reconciled = True
+
+        entries = sorted(self.index.items(), key=lambda i: i[1][1])
+        total = sum(size for name, (size, atime) in entries)
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for name, (size, atime) in entries:
+            if total <= self.max_bytes and atime >= cutoff:
+                break
+            # Skip files used since we took the snapshot.
+            if self.index.get(name, [size, atime])[1] != atime:
+                continue
+            self.index.pop(name)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning('Failed to remove cached art: {}'.format(e))
+            total -= size
+            removed += 1
+
+        logging.info('Art cache has {} files, {} bytes, removed {}'.format(len(self.index), total, removed))
+        self.index.save()
+
+    def _reconcile(self):
+        # Pick up art written by older versions or before a crash,
+        # and forget files that are gone.
+        on_disk = {}
+        with os.scandir(self.directory) as art_list:
+            for art in art_list:
+                if art.name.endswith((ART_SUFFIX, PIXELS_SUFFIX)) and art.is_file():
+                    stat = art.stat()
+                    on_disk[art.name] = (stat.st_size, stat.st_mtime)
+
+        indexed = dict(self.index.items())
+        for name in indexed.keys() - on_disk.keys():
+            self.index.pop(name)
+        for name, (size, mtime) in sorted(on_disk.items(), key=lambda i: i[1][1]):
+            if name not in indexed:
+                self.index[name] = [size, mtime]
+
+
+class ThumbnailCache:
+    """Decoded album art thumbnails
+
+    Songs of the same album share one pixbuf from an in-memory LRU of
+    max_entries. Thumbnails are also written to the art cache as raw
+    pre-scaled pixels, so later sessions don't have to decode the JPEG again.
+    This is thread-safe.
+    """
+
+    def __init__(self, art_cache, max_entries):
+        self.art_cache = art_cache
+        self.max_entries = max_entries
+        self._pixbufs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the thumbnail for key or None"""
+        with self._lock:
+            pixbuf = self._pixbufs.get(key)
+            if pixbuf is not None:
+                self._pixbufs.move_to_end(key)
+        if pixbuf is not None:
+            # Keep the raw pixels in the art cache as long as the thumbnail is used.
+            if self.art_cache is not None:
+                self.art_cache.touch(key, thumbnail=True, suffix=PIXELS_SUFFIX)
+            return pixbuf
+
+        if self.art_cache is None:
+            return None
+        data = self.art_cache.get(key, thumbnail=True, suffix=PIXELS_SUFFIX)
+        if data is None:
+            return None
+        pixbuf = self._from_pixels(data)
+        if pixbuf is None:
+            logging.warning('Ignoring invalid cached thumbnail {}'.format(key))
+            return None
+        return self._remember(key, pixbuf)
+
+    def put(self, key, pixbuf):
+        """Remembers pixbuf as the thumbnail for key, returns the one to use
+
+        That is the one already cached if another thread got there first.
+        """
+        pixbuf = self._remember(key, pixbuf)
+        if self.art_cache is not None:
+            self.art_cache.put(key, self._to_pixels(pixbuf), thumbnail=True, suffix=PIXELS_SUFFIX)
+        return pixbuf
+
+    def _remember(self, key, pixbuf):
+        with self._lock:
+            pixbuf = self._pixbufs.setdefault(key, pixbuf)
+            self._pixbufs.move_to_end(key)
+            while len(self._pixbufs) > self.max_entries:
+                self._pixbufs.popitem(last=False)
+        return pixbuf
+
+    @staticmethod
+    def _to_pixels(pixbuf):
+        header = _PIXELS_HEADER.pack(_PIXELS_MAGIC, pixbuf.get_width(), pixbuf.get_height(),
+                                     pixbuf.get_rowstride(), pixbuf.get_has_alpha())
+        return header + pixbuf.read_pixel_bytes().get_data()
+
+    @staticmethod
+    def _from_pixels(data):
+        try:
+            magic, width, height, rowstride, has_alpha = _PIXELS_HEADER.unpack_from(data)
+        except struct.error:
+            return None
+        channels = 4 if has_alpha else 3
+        # The last row isn't padded to the rowstride.
+        if magic != _PIXELS_MAGIC or len(data) - _PIXELS_HEADER.size != rowstride * (height - 1) + width * channels:
+            return None
+        pixels = GLib.Bytes.new(data[_PIXELS_HEADER.size:])
+        return GdkPixbuf.Pixbuf.new_from_bytes(pixels, GdkPixbuf.Colorspace.RGB, has_alpha, 8,
+                                               width, height, rowstride)
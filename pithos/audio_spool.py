@@ -0,0 +1,154 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Prefetched audio
+
+The next song is downloaded while the current one plays, so it can be
+played from a local file instead of depending on the CDN when it starts.
+"""
+
+import itertools
+import logging
+import os
+import shutil
+import threading
+import urllib.parse
+import urllib.request
+
+CHUNK_SIZE = 64 * 1024
+# Seconds to wait for the CDN before giving up on a prefetch.
+TIMEOUT = 30
+
+
+class _Download:
+    __slots__ = ('url', 'path', 'size', 'complete')
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.size = 0
+        self.complete = False
+
+
+class AudioSpool:
+    """Audio files of upcoming songs in directory, keyed by track token
+
+    Downloads are dropped instead of growing the spool beyond max_bytes.
+    Downloaded bytes are counted as 'audio' in bandwidth, a
+    :py:class:`pithos.util.BandwidthMeter`, if given. This is thread-safe.
+    """
+
+    def __init__(self, directory, max_bytes, bandwidth=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bandwidth = bandwidth
+        self._downloads = {}
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+        # Files left behind by a crash are of no use.
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size()
+
+    def _size(self):
+        return sum(download.size for download in self._downloads.values())
+
+    def wants(self, token, url):
+        """Whether url still has to be fetched for token"""
+        with self._lock:
+            download = self._downloads.get(token)
+            return download is None or download.url != url
+
+    def fetch(self, token, url, expected_size=0):
+        """Downloads url for token, returns the bytes downloaded if it completed, otherwise 0
+
+        Gives up when the download is removed or the spool gets full.
+        This does network IO, so call it from a worker thread.
+        """
+        with self._lock:
+            download = self._downloads.get(token)
+            if download is not None and download.url == url:
+                return 0
+            if self._size() + expected_size > self.max_bytes:
+                logging.info('Audio spool is full, not prefetching {}'.format(token))
+                return 0
+            path = os.path.join(self.directory, '{}.audio'.format(next(self._names)))
+            download = self._downloads[token] = _Download(url, path)
+
+        finished = False
+        try:
+            with urllib.request.urlopen(url, timeout=TIMEOUT) as response, open(download.path, 'wb') as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        finished = True
+                        break
+                    f.write(chunk)
+                    if self.bandwidth is not None:
+                        self.bandwidth.add('audio', len(chunk))
+                    with self._lock:
+                        if self._downloads.get(token) is not download:
+                            logging.debug('Prefetch of {} was cancelled'.format(token))
+                            break
+                        download.size += len(chunk)
+                        if self._size() > self.max_bytes:
+                            logging.info('Audio spool is full, not prefetching {}'.format(token))
+                            break
+        except Exception:
+            self._drop(token, download)
+            raise
+
+        # Only mark it complete once the file is closed.
+        with self._lock:
+            download.complete = finished and self._downloads.get(token) is download
+        if not download.complete:
+            self._drop(token, download)
+            return 0
+        logging.info('Prefetched {} bytes of audio for {}'.format(download.size, token))
+        return download.size
+
+    def file_url(self, token, url):
+        """Returns the file URL of the complete download of url for token, otherwise None"""
+        with self._lock:
+            download = self._downloads.get(token)
+            if download is None or download.url != url or not download.complete:
+                return None
+        return urllib.parse.urljoin('file://', urllib.parse.quote(download.path))
+
+    def remove(self, token):
+        with self._lock:
+            download = self._downloads.get(token)
+        if download is not None:
+            self._drop(token, download)
+
+    def retain(self, tokens):
+        """Removes the files of all songs but the ones in tokens"""
+        with self._lock:
+            downloads = [(token, download) for token, download in self._downloads.items() if token not in tokens]
+        for token, download in downloads:
+            self._drop(token, download)
+
+    def _drop(self, token, download):
+        with self._lock:
+            if self._downloads.get(token) is download:
+                del self._downloads[token]
+        try:
+            os.remove(download.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning('Failed to remove prefetched audio: {}'.format(e))
@@ -12,31 +12,181 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
 import logging
+import queue
 import threading
+import time
+from enum import IntEnum
 from gi.repository import GLib
 import traceback
 
+# Upper bound on the number of threads running USER and PLAYLIST jobs.
+MAX_THREADS = 6
+# BACKGROUND jobs get their own threads, so slow downloads
+# can't hold up the jobs the user is waiting on.
+MAX_BACKGROUND_THREADS = 4
+
+
+class Priority(IntEnum):
+    """Lanes of the worker queue, lower values run first"""
+    USER = 0        # Things the user is waiting on: rating, skipping, logging in, ...
+    PLAYLIST = 1    # Fetching songs to keep playback going
+    BACKGROUND = 2  # Album art, prefetching and other nice to haves
+
+
+class JobGroup:
+    """Jobs that are cancelled together
+
+    For example everything that was started for the current station.
+    Once cancelled a group stays cancelled, create a new one for new jobs.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Job:
+    """Handle returned by :py:meth:`GObjectWorker.send`
+
+    A cancelled job is dropped if it hasn't started yet and its
+    callback or errorback won't be called if it has.
+    """
+
+    def __init__(self, group=None):
+        self.group = group
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled or (self.group is not None and self.group.cancelled)
+
+    def cancel(self):
+        self._cancelled = True
+
+
+class _ThreadPool:
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self.queue = queue.PriorityQueue()
+        self.threads = 0
+        self.waiting_threads = 0
+        self.queued = 0
+
 
 class GObjectWorker:
+    """Runs commands on bounded pools of threads
+
+    Results are passed to callback and exceptions to errorback in the
+    main loop with GLib.idle_add(). Threads are started on demand up to
+    max_threads for USER and PLAYLIST commands and max_background_threads
+    for BACKGROUND ones. Queued commands are run by priority and then in
+    the order they were sent.
+    """
+
+    _default = None
+
+    def __init__(self, max_threads=MAX_THREADS, max_background_threads=MAX_BACKGROUND_THREADS):
+        self.max_threads = max_threads
+        self._foreground = _ThreadPool(max_threads)
+        self._background = _ThreadPool(max_background_threads)
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {priority: 0 for priority in Priority}
+        self._completed = {priority: 0 for priority in Priority}
+        self._cancelled = {priority: 0 for priority in Priority}
+        self._run_time = {priority: 0.0 for priority in Priority}
+        self._wait_time = {priority: 0.0 for priority in Priority}
+
+    @classmethod
+    def get_default(cls):
+        """Returns the worker shared by the window and plugins"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def send(self, command, args=(), callback=None, errorback=None, priority=Priority.USER, group=None):
+        if errorback is None:
+            errorback = self._default_errorback
+        job = Job(group)
+        data = job, command, args, callback, errorback, time.monotonic()
+        pool = self._background if priority is Priority.BACKGROUND else self._foreground
+        with self._lock:
+            self._pending[priority] += 1
+            pool.queued += 1
+            # Only start a thread if there aren't enough waiting for work already.
+            start_thread = pool.queued > pool.waiting_threads and pool.threads < pool.max_threads
+            if start_thread:
+                pool.threads += 1
+        pool.queue.put((priority, next(self._order), data))
+        if start_thread:
+            thread = threading.Thread(target=self._run, args=(pool,))
+            thread.daemon = True
+            thread.start()
+        return job
 
-    def send(self, command, args=(), callback=None, errorback=None):
-        def run(data):
-            command, args, callback, errorback = data
+    def _run(self, pool):
+        while True:
+            with self._lock:
+                pool.waiting_threads += 1
+            priority, order, data = pool.queue.get()
+            with self._lock:
+                pool.waiting_threads -= 1
+                pool.queued -= 1
+            job, command, args, callback, errorback, queued_time = data
+            if job.cancelled:
+                with self._lock:
+                    self._pending[priority] -= 1
+                    self._cancelled[priority] += 1
+                continue
+            start_time = time.monotonic()
             try:
                 result = command(*args)
                 if callback:
-                    GLib.idle_add(callback, result)
+                    GLib.idle_add(self._deliver, job, callback, result)
             except Exception as e:
                 e.traceback = traceback.format_exc()
                 if errorback:
-                    GLib.idle_add(errorback, e)
-        if errorback is None:
-            errorback = self._default_errorback
-        data = command, args, callback, errorback
-        thread = threading.Thread(target=run, args=(data,))
-        thread.daemon = True
-        thread.start()
+                    GLib.idle_add(self._deliver, job, errorback, e)
+            end_time = time.monotonic()
+            with self._lock:
+                self._pending[priority] -= 1
+                self._completed[priority] += 1
+                self._run_time[priority] += end_time - start_time
+                self._wait_time[priority] += start_time - queued_time
+
+    @staticmethod
+    def _deliver(job, fn, value):
+        # Jobs are cancelled from the main loop, so checking here is race free.
+        if not job.cancelled:
+            fn(value)
+        return False
+
+    @property
+    def queue_depth(self):
+        """Number of commands that are queued or running"""
+        with self._lock:
+            return sum(self._pending.values())
+
+    @property
+    def stats(self):
+        """Queue depth, completed and cancelled commands and average wait and run times in seconds per priority"""
+        with self._lock:
+            stats = {}
+            for priority in Priority:
+                completed = self._completed[priority]
+                stats[priority.name] = {
+                    'pending': self._pending[priority],
+                    'completed': completed,
+                    'cancelled': self._cancelled[priority],
+                    'avg_wait': self._wait_time[priority] / completed if completed else 0.0,
+                    'avg_run': self._run_time[priority] / completed if completed else 0.0,
+                }
+            stats['threads'] = self._foreground.threads + self._background.threads
+            return stats
 
     def _default_errorback(self, error):
         logging.error("Unhandled exception in worker thread:\n{}".format(error.traceback))
@@ -44,7 +194,6 @@ class GObjectWorker:
 
 if __name__ == '__main__':
     worker = GObjectWorker()
-    import time
     from gi.repository import Gtk
 
     def test_cmd(a, b):
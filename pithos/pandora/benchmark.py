@@ -0,0 +1,224 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Micro benchmarks for the Pandora client
+
+Run all of them with ``python3 -m pithos.pandora.benchmark`` or
+a single one with ``python3 -m pithos.pandora.benchmark blowfish``.
+"""
+
+import binascii
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from . import cipher
+from .blowfish import Blowfish
+from .data import client_keys
+from .pandora import Pandora, Song, Station, pad_block
+
+
+def report(name, fn, size=None, number=2000):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    if size is None:
+        throughput = ''
+    else:
+        throughput = '{:8.3f} MB/s'.format(size * number / seconds / 1e6)
+    print('{:<45} {:13} {:10.2f} us/call'.format(name, throughput, seconds / number * 1e6))
+
+
+def bench_blowfish():
+    client = client_keys['android-generic']
+    encoder = Blowfish(client['encryptKey'].encode('utf-8'))
+    decoder = Blowfish(client['decryptKey'].encode('utf-8'))
+
+    # A station.getPlaylist request body as built by Pandora.json_call.
+    playlist_request = pad_block(json.dumps({
+        'stationToken': '4114838287213624919',
+        'includeTrackLength': True,
+        'additionalAudioUrl': 'HTTP_32_AACPLUS,HTTP_128_MP3',
+        'syncTime': 1700000000,
+        'userAuthToken': 'XXH7FkfUcPiQwBG3nRYeXcdJt3mGxpPfHdn6rWwPQsCtxt8N6gFlTWbA==',
+    }).encode('utf-8'))
+    # The syncTime returned by auth.partnerLogin: 4 garbage bytes, 10 digits, padding.
+    sync_time = binascii.hexlify(decoder.encrypt(b'\xd1\x9c\x04\x8a1700000000\x02\x02'))
+
+    report('blowfish: getPlaylist encrypt (per block)',
+           lambda: b''.join(binascii.hexlify(encoder.encrypt(playlist_request[i:i+8]))
+                            for i in range(0, len(playlist_request), 8)),
+           len(playlist_request))
+    report('blowfish: getPlaylist encrypt (bulk)',
+           lambda: binascii.hexlify(encoder.encrypt_ecb(playlist_request)),
+           len(playlist_request))
+    report('blowfish: syncTime decrypt (per block)',
+           lambda: b''.join(decoder.decrypt(binascii.unhexlify(sync_time[i:i+16]))
+                            for i in range(0, len(sync_time), 16)),
+           len(sync_time) // 2)
+    report('blowfish: syncTime decrypt (bulk)',
+           lambda: decoder.decrypt_ecb(binascii.unhexlify(sync_time)),
+           len(sync_time) // 2)
+
+
+def bench_cipher():
+    key = client_keys['android-generic']['encryptKey'].encode('utf-8')
+    plaintext = os.urandom(8 * 64)
+    expected = None
+    for name, backend in cipher.backends.items():
+        c = backend(key)
+        encrypted = c.encrypt_ecb(plaintext)
+        # Every backend has to produce exactly the same bytes.
+        if expected is None:
+            expected = encrypted
+        assert encrypted == expected, '{} encrypts differently'.format(name)
+        assert c.decrypt_ecb(memoryview(encrypted)) == plaintext, '{} decrypts differently'.format(name)
+        report('cipher: {} encrypt'.format(name), lambda: c.encrypt_ecb(plaintext), len(plaintext))
+
+
+def bench_stations(count=300):
+    pandora = Pandora()
+    for i in range(count):
+        pandora.add_station(Station(pandora, {
+            'stationId': str(1000 + i),
+            'stationToken': str(5000 + i),
+            'isShared': False,
+            'isQuickMix': False,
+            'stationName': 'Station {}'.format(i),
+        }))
+    last_id = pandora.stations[-1].id
+
+    def linear_scan():
+        for i in pandora.stations:
+            if i.id == last_id:
+                return i
+
+    report('stations: {} stations, linear scan'.format(count), linear_scan, number=20000)
+    report('stations: {} stations, get_station_by_id'.format(count),
+           lambda: pandora.get_station_by_id(last_id), number=20000)
+
+
+def fake_song_dict(i):
+    url = 'http://audio-sv5-t1-2.pandora.com/access/{}.mp4?version=5&lid=1&token=' + 'x' * 200
+    return {
+        'albumName': 'Album {}'.format(i),
+        'artistName': 'Artist {}'.format(i),
+        'trackToken': str(3000000000 + i),
+        'songRating': 0,
+        'stationId': '1000',
+        'songName': 'Song {}'.format(i),
+        'songDetailUrl': 'http://www.pandora.com/artist/song-{}/detail'.format(i),
+        'songExplorerUrl': 'http://www.pandora.com/xml/music/track/artist/song-{}?explicit=false'.format(i),
+        'albumArtUrl': 'http://cont-2.p-cdn.com/images/public/amz/{}.jpg'.format(i),
+        'trackLength': 240,
+        'trackGain': '1.23',
+        'audioUrlMap': {
+            quality: {'encoding': 'aacplus', 'bitrate': bitrate, 'audioUrl': url.format(i)}
+            for quality, bitrate in (('highQuality', '64'), ('mediumQuality', '64'), ('lowQuality', '32'))
+        },
+    }
+
+
+class _DictSong:
+    """Song as it was before __slots__, for comparison"""
+    def __init__(self, song, d):
+        for name in Song.__slots__:
+            setattr(self, name, getattr(song, name))
+        self.audioUrlMap = {k: dict(v) for k, v in d['audioUrlMap'].items()}
+
+
+def bench_songs(count=1000):
+    pandora = Pandora()
+    dicts = [fake_song_dict(i) for i in range(count)]
+
+    def measure(make):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        songs = [make(d) for d in dicts]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        return size // len(songs)
+
+    templates = [Song(pandora, d, 0) for d in dicts]
+    print('songs: {} bytes per Song before __slots__'.format(
+        measure(lambda d, t=iter(templates): _DictSong(next(t), d))))
+    print('songs: {} bytes per Song with __slots__'.format(
+        measure(lambda d: Song(pandora, d, 0))))
+
+
+def rss():
+    """Resident set size of this process in bytes"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def bench_history(hours=24, history=50):
+    """Soak test of the song list, keeping every song or only the last history ones
+
+    Drives the eviction PithosWindow does on a Gtk.ListStore like its song
+    list and checks that the rows stay numbered and the current song stays.
+    """
+    if not os.path.exists('/proc/self/statm'):
+        print('history: needs /proc/self/statm')
+        return
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import GObject, Gtk
+    except (ImportError, ValueError):
+        print('history: needs PyGObject with Gtk 3')
+        return
+    from ..song_history import evict_song_history
+
+    pandora = Pandora()
+    # A 96x96 RGB thumbnail per song, as if each song had a different album.
+    art_size = 96 * 96 * 3
+    songs_per_hour = 15
+
+    def soak(bounded):
+        songs_model = Gtk.ListStore(GObject.TYPE_PYOBJECT, str, str, GObject.TYPE_PYOBJECT)
+        current_index = None
+        start = rss()
+        for hour in range(1, hours + 1):
+            for i in range(songs_per_hour):
+                song = Song(pandora, fake_song_dict(hour * songs_per_hour + i), 0)
+                song.art_pixbuf = bytearray(art_size)
+                song.index = len(songs_model)
+                songs_model.append((song, '', None, song.art_pixbuf))
+                current_index = song.index
+                if bounded:
+                    current_index -= len(evict_song_history(songs_model, current_index, history))
+                assert songs_model[current_index][0] is song, 'the current song was evicted'
+                assert all(row[0].index == i for i, row in enumerate(songs_model)), 'rows are misnumbered'
+            if hour % 6 == 0 or hour == hours:
+                print('history: {:<9} {:3} hours, {:5} songs, RSS +{:8} kB'.format(
+                    'bounded' if bounded else 'unbounded', hour, len(songs_model), (rss() - start) // 1024))
+
+    # Bounded first, so it doesn't reuse memory freed by the unbounded run.
+    soak(True)
+    soak(False)
+
+
+benchmarks = {
+    'blowfish': bench_blowfish,
+    'cipher': bench_cipher,
+    'stations': bench_stations,
+    'songs': bench_songs,
+    'history': bench_history,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
@@ -42,6 +42,7 @@ adaptation of Bruce Schneier's `C implementation
 """
 
 import copy
+import struct
 
 class VCryptoException(Exception):
     """Exception for crypto operations."""
@@ -98,6 +99,9 @@ class Blowfish:
                              (data[5] << 16) +
                              (data[6] << 8 ) + data[7])
 
+        # Decryption is encryption with the subkeys applied in reverse order.
+        self.__P_reversed = P[::-1]
+
     def __feistel(self, x):
         S = self.__S
         d = x & 0xff
@@ -137,14 +141,7 @@ class Blowfish:
         if len_data == 8:
             return self._encrypt_block(data)
         else:
-            result = []
-            start = 0
-            while start < len_data:
-                end = start + 8
-                block = data[start:end]
-                result.append(self._encrypt_block(block))
-                start += 8
-            return b''.join(result)
+            return self.encrypt_ecb(data)
 
     def _encrypt_block(self, block):
         if not isinstance(block, bytes) or len(block) != 8:
@@ -185,14 +182,7 @@ class Blowfish:
         if len_data == 8:
             return self._decrypt_block(data)
         else:
-            result = []
-            start = 0
-            while start < len_data:
-                end = start + 8
-                block = data[start:end]
-                result.append(self._decrypt_block(block))
-                start += 8
-            return b''.join(result)
+            return self.decrypt_ecb(data)
 
     def _decrypt_block(self, block):
         if not isinstance(block, bytes) or len(block) != 8:
@@ -216,6 +206,58 @@ class Blowfish:
 
         return bytes([b & 0xff for b in bval])
 
+    def encrypt_ecb(self, data):
+        """Encipher a whole buffer in ECB mode.
+
+        :param data:  plaintext to encrypt
+        :type  data:  bytes, bytearray or memoryview
+        :returns:     encrypted data
+        :rtype:       bytes
+
+        The data must align with 8-byte blocksize. All blocks are
+        unpacked and packed in a single pass and the Feistel rounds
+        are inlined, which is much faster than calling :meth:`encrypt`
+        once per block.
+
+        """
+        return self.__ecb(data, self.__P)
+
+    def decrypt_ecb(self, data):
+        """Decipher a whole buffer in ECB mode.
+
+        :param data:  encrypted data
+        :type  data:  bytes, bytearray or memoryview
+        :returns:     decrypted plaintext
+        :rtype:       bytes
+
+        The data must align with 8-byte blocksize.
+
+        """
+        return self.__ecb(data, self.__P_reversed)
+
+    def __ecb(self, data, P):
+        len_data = len(data)
+        if len_data % 8:
+            raise VCryptoException('Data not aligned with 8-byte blocksize')
+        fmt = '>%dI' % (len_data // 4)
+        words = struct.unpack(fmt, data)
+        S0, S1, S2, S3 = self.__S
+        rounds = P[:16]
+        p16, p17 = P[16], P[17]
+        result = []
+        append = result.append
+        for i in range(0, len(words), 2):
+            b_l = words[i]
+            b_r = words[i+1]
+            for p in rounds:
+                b_l ^= p
+                b_r ^= (((S0[b_l >> 24] + S1[b_l >> 16 & 0xff]) ^ S2[b_l >> 8 & 0xff])
+                        + S3[b_l & 0xff]) & 0xffffffff
+                b_l, b_r = b_r, b_l
+            append(b_r ^ p17)
+            append(b_l ^ p16)
+        return struct.pack(fmt, *result)
+
 # These are the standard initialization values of P and S blocks for the
 # cipher. The constants are internal to this module and should not be accessed
 # directly or modified by outside code.
@@ -396,4 +438,4 @@ _S_INIT = [[0xd1310ba6,0x98dfb5ac,0x2ffd72db,0xd01adfb7,0xb8e1afed,0x6a267e96,
             0x85cbfe4e,0x8ae88dd8,0x7aaaf9b0,0x4cf9aa7e,0x1948c25c,0x02fb8a8c,
             0x01c36ae4,0xd6ebe1f9,0x90d4f869,0xa65cdea0,0x3f09252d,0xc208e69f,
             0xb74e6132,0xce77e25b,0x578fdfe3,0x3ac372e6]
-           ]
\ No newline at end of file
+           ]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Blowfish-ECB backends
+
+The Pandora API only needs Blowfish in ECB mode. A native implementation
+from cryptography or pycryptodome is used when one is installed, otherwise
+we fall back to the pure Python :py:class:`pithos.pandora.blowfish.Blowfish`.
+
+The backend can be forced by setting the ``PITHOS_CIPHER_BACKEND``
+environment variable to one of the names in :py:data:`backends`.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+
+from .blowfish import Blowfish
+
+BACKEND_ENV = 'PITHOS_CIPHER_BACKEND'
+
+
+class PythonCipher:
+    name = 'python'
+
+    def __init__(self, key):
+        self._blowfish = Blowfish(key)
+
+    def encrypt_ecb(self, data):
+        return self._blowfish.encrypt_ecb(data)
+
+    def decrypt_ecb(self, data):
+        return self._blowfish.decrypt_ecb(data)
+
+
+class CryptographyCipher:
+    name = 'cryptography'
+
+    def __init__(self, key):
+        self._cipher = _cryptography.Cipher(_cryptography_blowfish(key), _cryptography.modes.ECB())
+
+    def encrypt_ecb(self, data):
+        encryptor = self._cipher.encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt_ecb(self, data):
+        decryptor = self._cipher.decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+
+class PyCryptodomeCipher:
+    name = 'pycryptodome'
+
+    def __init__(self, key):
+        self._key = key
+
+    def encrypt_ecb(self, data):
+        return _pycryptodome.new(self._key, _pycryptodome.MODE_ECB).encrypt(bytes(data))
+
+    def decrypt_ecb(self, data):
+        return _pycryptodome.new(self._key, _pycryptodome.MODE_ECB).decrypt(bytes(data))
+
+
+# Available backends, in order of preference.
+backends = OrderedDict()
+
+try:
+    from cryptography.hazmat.primitives import ciphers as _cryptography
+    try:
+        # Blowfish moved here in cryptography 43 and was removed from algorithms later on.
+        from cryptography.hazmat.decrepit.ciphers.algorithms import Blowfish as _cryptography_blowfish
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.algorithms import Blowfish as _cryptography_blowfish
+except ImportError:
+    pass
+else:
+    backends[CryptographyCipher.name] = CryptographyCipher
+
+try:
+    from Crypto.Cipher import Blowfish as _pycryptodome
+except ImportError:
+    pass
+else:
+    backends[PyCryptodomeCipher.name] = PyCryptodomeCipher
+
+backends[PythonCipher.name] = PythonCipher
+
+
+def _default_backend():
+    name = os.environ.get(BACKEND_ENV)
+    if name:
+        if name in backends:
+            return backends[name]
+        logging.warning('Cipher backend "{}" from {} is not available'.format(name, BACKEND_ENV))
+    return next(iter(backends.values()))
+
+
+backend = _default_backend()
+
+
+def set_backend(name):
+    """Select the backend used by :py:func:`new` by name"""
+    global backend
+    backend = backends[name]
+
+
+def new(key):
+    """Returns a Blowfish-ECB cipher for key from the selected backend
+
+    The cipher has ``encrypt_ecb`` and ``decrypt_ecb`` methods that take
+    data aligned to the 8-byte blocksize.
+    """
+    return backend(key)
@@ -18,6 +18,7 @@ from gi.repository import Gtk
 import logging
 
 TEST_FILE = "http://pithos.github.io/testfile.aac"
+FAKE_CHECKSUM = "d41d8cd98f00b204e9800998ecf8427e"
 
 class FakePandora(Pandora):
     def __init__(self):
@@ -54,7 +55,7 @@ class FakePandora(Pandora):
     def set_authenticated(self):
         self.auth_check.set_active(True)
 
-    def json_call(self, method, args=None, https=False, blowfish=True):
+    def _json_call(self, method, args=None, https=False, blowfish=True, auth=None):
         time.sleep(1)
         self.maybe_fail()
 
@@ -66,7 +67,9 @@ class FakePandora(Pandora):
                 {'stationId':'432', 'stationToken':'345485', 'isShared':False, 'isQuickMix':False, 'stationName':"Test Station 2"},
                 {'stationId':'254', 'stationToken':'345415', 'isShared':False, 'isQuickMix':False, 'stationName':"Test Station 4 - Out of Order"},
                 {'stationId':'343', 'stationToken':'345435', 'isShared':False, 'isQuickMix':False, 'stationName':"Test Station 3"},
-            ]}
+            ], 'checksum': FAKE_CHECKSUM}
+        elif method == 'user.getStationListChecksum':
+            return {'checksum': FAKE_CHECKSUM}
         elif method == 'station.getPlaylist':
             stationId = self.get_station_by_token(args['stationToken']).id
             return {'items': [self.makeFakeSong(stationId) for i in range(4)]}
@@ -95,14 +98,13 @@ class FakePandora(Pandora):
         else:
             logging.error("Invalid method %s" % method)
 
-    def connect(self, client, user, password):
+    def _login(self, client, user, password):
         self.set_authenticated()
-        self.get_stations()
+        return AuthState(None, 'fake', None, 'fake-{}'.format(self.count()), None), False
 
-    def get_station_by_token(self, token):
-        for i in self.stations:
-            if i.idToken == token:
-                return i
+    def connect(self, client, user, password):
+        super().connect(client, user, password)
+        self.get_stations()
 
     def makeFakeSong(self, stationId):
         c = self.count()
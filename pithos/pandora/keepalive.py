@@ -0,0 +1,176 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent HTTP connections for urllib openers
+
+urllib.request closes the socket after every request, so every API call
+pays a new TCP (and TLS) handshake. The handlers in this module keep idle
+connections around in a :py:class:`ConnectionPool` keyed by
+(scheme, host, tunnel host) so they can be reused by the next request.
+"""
+
+import http.client
+import io
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+import urllib.response
+
+# Seconds an idle connection is kept before it is thrown away.
+# Servers commonly drop idle keep-alive connections after about a minute.
+IDLE_TIMEOUT = 30
+# Maximum number of idle connections kept per (scheme, host, proxy).
+MAX_IDLE_PER_HOST = 2
+
+# Errors that mean a reused connection was closed by the other end
+# while it sat in the pool. The request is retried once on a fresh connection.
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError)
+
+
+class ConnectionPool:
+    """Thread-safe pool of idle http.client connections"""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns an idle connection for key or None"""
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(candidate)
+                else:
+                    conn = candidate
+                    break
+            if conn is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        for c in expired:
+            c.close()
+        return conn
+
+    def put(self, key, conn):
+        """Returns a connection to the pool, closing it if the pool is full"""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+    @property
+    def stats(self):
+        with self._lock:
+            idle = sum(len(i) for i in self._idle.values())
+        return {'hits': self.hits, 'misses': self.misses, 'idle': idle}
+
+
+class _KeepAliveMixin:
+    def __init__(self, *args, pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            # Proxy-Authorization should not be sent to origin server.
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        key = (req.type, host, req._tunnel_host)
+
+        conn = self.pool.get(key)
+        if conn is not None:
+            conn.timeout = req.timeout
+            if conn.sock:
+                conn.sock.settimeout(req.timeout)
+            try:
+                response = self._send(conn, req, headers, reused=True)
+            except _STALE_ERRORS:
+                logging.debug('Pooled connection to %s went stale, reconnecting', host)
+                conn.close()
+                conn = None
+
+        if conn is None:
+            conn = http_class(host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(self._debuglevel)
+            if req._tunnel_host:
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            response = self._send(conn, req, headers, reused=False)
+
+        # Read the whole body so the connection is free for the next request.
+        try:
+            body = response.read()
+        except:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(key, conn)
+
+        result = urllib.response.addinfourl(io.BytesIO(body), response.headers, req.get_full_url(), response.status)
+        result.msg = response.reason
+        return result
+
+    @staticmethod
+    def _send(conn, req, headers, reused):
+        try:
+            try:
+                conn.request(req.get_method(), req.selector, req.data, headers,
+                             encode_chunked=req.has_header('Transfer-encoding'))
+            except OSError as err: # timeout error
+                if reused and isinstance(err, _STALE_ERRORS):
+                    raise
+                raise urllib.error.URLError(err)
+            return conn.getresponse()
+        except:
+            conn.close()
+            raise
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib.request.HTTPHandler):
+    pass
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib.request.HTTPSHandler):
+    pass
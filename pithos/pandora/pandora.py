@@ -18,29 +18,35 @@
 See http://6xq.net/playground/pandora-apidoc/json/ for API documentation.
 """
 
-from .blowfish import Blowfish
-# from Crypto.Cipher import Blowfish
 from xml.dom import minidom
 import re
 import json
 import logging
 import time
 import urllib.request, urllib.parse, urllib.error
-import codecs
+import binascii
 import ssl
 import os
+import threading
+from collections import deque, namedtuple
 from enum import IntEnum
 from socket import error as SocketError
 
-from . import data
+from . import cipher, data
+from .keepalive import ConnectionPool, KeepAliveHTTPHandler, KeepAliveHTTPSHandler
 
 HTTP_TIMEOUT = 30
+# Song title lookups are cosmetic, don't let a slow one hang around.
+TITLE_LOOKUP_TIMEOUT = 5
 USER_AGENT = 'pithos'
 
 RATE_BAN = 'ban'
 RATE_LOVE = 'love'
 RATE_NONE = None
 
+# Audio qualities from the lowest bitrate to the highest.
+AUDIO_QUALITIES = ('lowQuality', 'mediumQuality', 'highQuality')
+
 class ApiError(IntEnum):
     INTERNAL_ERROR = 0
     MAINTENANCE_MODE = 1
@@ -126,9 +132,29 @@ class ApiError(IntEnum):
             return None
 
 PLAYLIST_VALIDITY_TIME = 60*60
+# Client side budget of station.getPlaylist calls made ahead of time per window,
+# so fetching songs in advance doesn't run into PLAYLIST_EXCEEDED (1039).
+PLAYLIST_BUDGET = 24
+PLAYLIST_BUDGET_WINDOW = 60*60
+
+# How long a userAuthToken is assumed to stay valid. Pandora doesn't document it,
+# so it is lowered when tokens expire sooner, down to AUTH_TOKEN_MIN_LIFETIME,
+# and raised again when one outlives it, see Pandora._learn_auth_token_lifetime().
+AUTH_TOKEN_LIFETIME = 2*60*60
+AUTH_TOKEN_MIN_LIFETIME = 10*60
+# Fraction of the lifetime after which the token should be refreshed ahead of time.
+AUTH_REFRESH_FRACTION = 0.8
 
 NAME_COMPARE_REGEX = re.compile(r'[^A-Za-z0-9]')
 
+# One entry of Song.audioUrlMap
+AudioUrl = namedtuple('AudioUrl', ('encoding', 'bitrate', 'audioUrl'))
+
+# Everything a call needs from the logins. It is replaced as a whole so a
+# call never mixes tokens from two logins.
+AuthState = namedtuple('AuthState', ('partnerId', 'userId', 'partnerAuthToken', 'userAuthToken', 'time_offset'))
+NO_AUTH = AuthState(None, None, None, None, None)
+
 class PandoraError(IOError):
     def __init__(self, message, status=None, submsg=None):
         self.status = status
@@ -143,6 +169,9 @@ class PandoraTimeout(PandoraNetError): pass
 def pad(s, l):
     return s + b'\0' * (l - len(s))
 
+def pad_block(s, block_size=8):
+    return pad(s, len(s) + -len(s) % block_size)
+
 class Pandora:
     """Access the Pandora API
 
@@ -159,36 +188,156 @@ class Pandora:
         self.opener = self.build_opener()
         self.connected = False
         self.isSubscriber = False
+        # Titles resolved by Song.resolve_title() keyed by songExplorerUrl.
+        # Replace with a persistent mapping to keep them across sessions.
+        self.song_titles = {}
+        # The last station list and its checksum keyed by userId, see get_stations().
+        # Replace with a persistent mapping to keep them across sessions.
+        self.station_lists = {}
+        # Counts the bytes of API calls when set to a pithos.util.BandwidthMeter.
+        self.bandwidth = None
+        self.stations = []
+        self.stations_checksum = None
+        self._stations_by_id = {}
+        self._stations_by_token = {}
+        # Held while logging in so concurrent calls wait for the new tokens
+        # instead of failing, see json_call().
+        self._auth_lock = threading.RLock()
+        self._login_args = None
+        self.auth = NO_AUTH
+        # Wall clock time of the last login, see auth_refresh_in.
+        self.auth_time = None
+        self.auth_token_lifetime = AUTH_TOKEN_LIFETIME
+        # Whether the tokens came from resume(), they may have been revoked by a login elsewhere.
+        self.auth_resumed = False
+        # Age at which the last token expired before auth_token_lifetime, see _learn_auth_token_lifetime().
+        self._early_expiry = None
+        # Times of recent station.getPlaylist calls, see playlist_budget_left().
+        self.playlist_requests = deque()
+
+    @property
+    def partnerId(self):
+        return self.auth.partnerId
+
+    @property
+    def userId(self):
+        return self.auth.userId
+
+    @property
+    def partnerAuthToken(self):
+        return self.auth.partnerAuthToken
+
+    @property
+    def userAuthToken(self):
+        return self.auth.userAuthToken
+
+    @property
+    def time_offset(self):
+        return self.auth.time_offset
+
+    @property
+    def auth_token_age(self):
+        """Seconds since the user logged in or None"""
+        if self.auth_time is None:
+            return None
+        return time.time() - self.auth_time
+
+    @property
+    def auth_refresh_in(self):
+        """Seconds until :py:meth:`refresh_auth` should be called to replace the token before it expires"""
+        age = self.auth_token_age
+        if age is None:
+            return None
+        return max(0, self.auth_token_lifetime * AUTH_REFRESH_FRACTION - age)
 
     def pandora_encrypt(self, s):
-        return b''.join([codecs.encode(self.blowfish_encode.encrypt(pad(s[i:i+8], 8)), 'hex_codec') for i in range(0, len(s), 8)])
+        return binascii.hexlify(self.blowfish_encode.encrypt_ecb(pad_block(s)))
 
     def pandora_decrypt(self, s):
-        return b''.join([self.blowfish_decode.decrypt(pad(codecs.decode(s[i:i+16], 'hex_codec'), 8)) for i in range(0, len(s), 16)]).rstrip(b'\x08')
+        return self.blowfish_decode.decrypt_ecb(pad_block(binascii.unhexlify(s))).rstrip(b'\x08')
 
     def json_call(self, method, args=None, https=False, blowfish=True):
+        """Call method, logging in again and replaying the call if the auth token expired
+
+        Concurrent calls that fail with an invalid token share a single login.
+        """
+        # Don't start a call with tokens that are being replaced.
+        with self._auth_lock:
+            auth = self.auth
+        try:
+            result = self._json_call(method, args, https, blowfish, auth)
+        except PandoraAuthTokenInvalid:
+            if method.startswith('auth.') or not self._relogin(auth):
+                raise
+            logging.info("Replaying %s with the new auth token", method)
+            return self._json_call(method, args, https, blowfish, self.auth)
+        if auth is self.auth and auth.userAuthToken:
+            self._learn_auth_token_lifetime(self.auth_token_age, expired=False)
+        return result
+
+    def _relogin(self, failed_auth):
+        """Log in again unless another call already did since failed_auth was used"""
+        if self._login_args is None:
+            return False
+        with self._auth_lock:
+            if not self.connected:
+                self.connect(*self._login_args)
+            elif self.auth is failed_auth:
+                age = self.auth_token_age
+                logging.info("Auth token expired after %d seconds, logging in again", age)
+                self._learn_auth_token_lifetime(age, expired=True)
+                self._set_auth(*self._login(*self._login_args))
+        return True
+
+    def _learn_auth_token_lifetime(self, age, expired):
+        """Adjust auth_token_lifetime to a token that expired or still worked at age seconds
+
+        Resumed tokens say nothing about the lifetime, they may have been revoked.
+        A single early expiry could be a token revoked by a login elsewhere, so the
+        lifetime is only lowered once two tokens in a row expired early.
+        """
+        if age is None or self.auth_resumed:
+            return
+        if not expired:
+            if self.auth_token_lifetime < age:
+                logging.info("Auth token outlived the assumed lifetime of %d seconds", self.auth_token_lifetime)
+                self.auth_token_lifetime = max(age, AUTH_TOKEN_LIFETIME)
+                self._early_expiry = None
+            return
+        if age >= self.auth_token_lifetime:
+            self._early_expiry = None
+        elif self._early_expiry is None:
+            self._early_expiry = age
+        else:
+            self.auth_token_lifetime = max(min(age, self._early_expiry), AUTH_TOKEN_MIN_LIFETIME)
+            self._early_expiry = None
+            logging.info("Assuming auth tokens expire after %d seconds", self.auth_token_lifetime)
+
+    def _json_call(self, method, args=None, https=False, blowfish=True, auth=None):
+        if auth is None:
+            auth = self.auth
         if not args:
             args = {}
         url_arg_strings = []
-        if self.partnerId:
-            url_arg_strings.append('partner_id=%s'%self.partnerId)
-        if self.userId:
-            url_arg_strings.append('user_id=%s'%self.userId)
-        if self.userAuthToken:
-            url_arg_strings.append('auth_token=%s'%urllib.parse.quote_plus(self.userAuthToken))
-        elif self.partnerAuthToken:
-            url_arg_strings.append('auth_token=%s'%urllib.parse.quote_plus(self.partnerAuthToken))
+        if auth.partnerId:
+            url_arg_strings.append('partner_id=%s'%auth.partnerId)
+        if auth.userId:
+            url_arg_strings.append('user_id=%s'%auth.userId)
+        if auth.userAuthToken:
+            url_arg_strings.append('auth_token=%s'%urllib.parse.quote_plus(auth.userAuthToken))
+        elif auth.partnerAuthToken:
+            url_arg_strings.append('auth_token=%s'%urllib.parse.quote_plus(auth.partnerAuthToken))
 
         url_arg_strings.append('method=%s'%method)
         protocol = 'https' if https else 'http'
         url = protocol + self.rpcUrl + '&'.join(url_arg_strings)
 
-        if self.time_offset:
-            args['syncTime'] = int(time.time()+self.time_offset)
-        if self.userAuthToken:
-            args['userAuthToken'] = self.userAuthToken
-        elif self.partnerAuthToken:
-            args['partnerAuthToken'] = self.partnerAuthToken
+        if auth.time_offset:
+            args['syncTime'] = int(time.time()+auth.time_offset)
+        if auth.userAuthToken:
+            args['userAuthToken'] = auth.userAuthToken
+        elif auth.partnerAuthToken:
+            args['partnerAuthToken'] = auth.partnerAuthToken
         data = json.dumps(args).encode('utf-8')
 
         logging.debug(url)
@@ -201,6 +350,7 @@ class Pandora:
             req = urllib.request.Request(url, data, {'User-agent': USER_AGENT, 'Content-type': 'text/plain'})
             with self.opener.open(req, timeout=HTTP_TIMEOUT) as response:
                 text = response.read().decode('utf-8')
+            self.count_bytes(len(data) + len(text))
         except urllib.error.HTTPError as e:
             logging.error("HTTP error: %s", e)
             raise PandoraNetError(str(e))
@@ -255,21 +405,57 @@ class Pandora:
         """
         self.audio_quality = fmt
 
+    def count_bytes(self, size):
+        """Adds size bytes of API traffic to :py:attr:`bandwidth`"""
+        if self.bandwidth is not None:
+            self.bandwidth.add('api', size)
+
     @staticmethod
-    def build_opener(*handlers):
+    def build_opener(*handlers, keep_alive=True):
         """Creates a new opener
 
         Wrapper around urllib.request.build_opener() that adds
-        a custom ssl.SSLContext for use with internal-tuner.pandora.com
+        a custom ssl.SSLContext for use with internal-tuner.pandora.com.
+        With keep_alive connections are kept in a shared
+        :py:class:`pithos.pandora.keepalive.ConnectionPool` available
+        as the opener's ``connection_pool`` attribute. Those handlers read
+        whole responses before returning, so only use them for API calls.
         """
         ctx = ssl.create_default_context()
         ctx.load_verify_locations(cadata=data.internal_cert)
-        https = urllib.request.HTTPSHandler(context=ctx)
-        return urllib.request.build_opener(https, *handlers)
+        if not keep_alive:
+            https = urllib.request.HTTPSHandler(context=ctx)
+            return urllib.request.build_opener(https, *handlers)
+        pool = ConnectionPool()
+        http = KeepAliveHTTPHandler(pool=pool)
+        https = KeepAliveHTTPSHandler(context=ctx, pool=pool)
+        opener = urllib.request.build_opener(http, https, *handlers)
+        opener.connection_pool = pool
+        return opener
 
     def set_url_opener(self, opener):
+        if opener is not self.opener:
+            pool = self.connection_pool
+            if pool is not None:
+                logging.debug("Connection pool stats: %s", pool.stats)
+                pool.clear()
         self.opener = opener
 
+    def playlist_budget_left(self):
+        """Number of station.getPlaylist calls that can still be made ahead of time
+
+        Songs needed right away should be fetched regardless.
+        """
+        cutoff = time.time() - PLAYLIST_BUDGET_WINDOW
+        while self.playlist_requests and self.playlist_requests[0] < cutoff:
+            self.playlist_requests.popleft()
+        return max(0, PLAYLIST_BUDGET - len(self.playlist_requests))
+
+    @property
+    def connection_pool(self):
+        """The :py:class:`pithos.pandora.keepalive.ConnectionPool` of the current opener, if any"""
+        return getattr(self.opener, 'connection_pool', None)
+
     def connect(self, client, user, password):
         """Connect to the Pandora API and log the user in
 
@@ -277,34 +463,102 @@ class Pandora:
         :param user:     The user's login email
         :param password: The user's login password
         """
-        self.connected = False
-        self.partnerId = self.userId = self.partnerAuthToken = None
-        self.userAuthToken = self.time_offset = None
+        login_args = (client, user, password)
+        with self._auth_lock:
+            self.connected = False
+            self.auth = NO_AUTH
+            self._set_client(client)
+
+            self._set_auth(*self._login(client, user, password))
+            self.connected = True
+            self._login_args = login_args
+
+    def session(self):
+        """Returns the current login as a JSON serializable dict for :py:meth:`resume` or None"""
+        if not self.connected:
+            return None
+        client = self._login_args[0]
+        session = self.auth._asdict()
+        session.update({
+            'auth_time': self.auth_time,
+            'isSubscriber': self.isSubscriber,
+            'rpcUrl': client['rpcUrl'],
+            'deviceModel': client['deviceModel'],
+        })
+        return dict(session)
+
+    def resume(self, client, user, password, session):
+        """Reuse a login saved with :py:meth:`session` instead of connecting
 
+        Returns False if the session belongs to another client or its token is
+        likely expired. If the token turns out to be invalid anyway the first
+        call logs in again with the given credentials.
+        """
+        if session.get('rpcUrl') != client['rpcUrl'] or session.get('deviceModel') != client['deviceModel']:
+            return False
+        try:
+            auth = AuthState(*(session[field] for field in AuthState._fields))
+            age = time.time() - session['auth_time']
+            is_subscriber = session['isSubscriber']
+        except (KeyError, TypeError):
+            return False
+        if not 0 <= age < self.auth_token_lifetime:
+            return False
+
+        with self._auth_lock:
+            self.connected = False
+            self._set_client(client)
+            self.auth = auth
+            self.auth_time = session['auth_time']
+            self.auth_resumed = True
+            self.isSubscriber = is_subscriber
+            self.connected = True
+            self._login_args = (client, user, password)
+        logging.info("Resumed session from %d seconds ago", age)
+        return True
+
+    def _set_client(self, client):
         self.rpcUrl = client['rpcUrl']
-        self.blowfish_encode = Blowfish(client['encryptKey'].encode('utf-8'))
-        self.blowfish_decode = Blowfish(client['decryptKey'].encode('utf-8'))
+        logging.info("Using %s Blowfish backend", cipher.backend.name)
+        self.blowfish_encode = cipher.new(client['encryptKey'].encode('utf-8'))
+        self.blowfish_decode = cipher.new(client['decryptKey'].encode('utf-8'))
+
+    def refresh_auth(self):
+        """Log in again before the auth token expires
 
-        partner = self.json_call('auth.partnerLogin', {
+        The new tokens are swapped in once both logins succeeded, so calls
+        made in the meantime keep using the old ones.
+        """
+        if not self.connected:
+            return
+        logging.info("Refreshing auth token after %d seconds", self.auth_token_age)
+        auth, is_subscriber = self._login(*self._login_args)
+        with self._auth_lock:
+            self._set_auth(auth, is_subscriber)
+
+    def _set_auth(self, auth, is_subscriber):
+        self.auth = auth
+        self.auth_time = time.time()
+        self.auth_resumed = False
+        self.isSubscriber = is_subscriber
+
+    def _login(self, client, user, password):
+        """Runs the partner and user logins, returns the new AuthState and whether the user is a subscriber"""
+        partner = self._json_call('auth.partnerLogin', {
             'deviceModel': client['deviceModel'],
             'username': client['username'], # partner username
             'password': client['password'], # partner password
             'version': client['version']
-            },https=True, blowfish=False)
-
-        self.partnerId = partner['partnerId']
-        self.partnerAuthToken = partner['partnerAuthToken']
+            },https=True, blowfish=False, auth=NO_AUTH)
 
         pandora_time = int(self.pandora_decrypt(partner['syncTime'].encode('utf-8'))[4:14])
-        self.time_offset = pandora_time - time.time()
-        logging.info("Time offset is %s", self.time_offset)
-        auth_args = {'username': user, 'password': password, 'loginType': 'user', 'returnIsSubscriber': True}
-        user = self.json_call('auth.userLogin', auth_args, https=True)
-        self.userId = user['userId']
-        self.userAuthToken = user['userAuthToken']
+        time_offset = pandora_time - time.time()
+        logging.info("Time offset is %s", time_offset)
+        auth = AuthState(partner['partnerId'], None, partner['partnerAuthToken'], None, time_offset)
 
-        self.connected = True
-        self.isSubscriber = user['isSubscriber']
+        auth_args = {'username': user, 'password': password, 'loginType': 'user', 'returnIsSubscriber': True}
+        user = self._json_call('auth.userLogin', auth_args, https=True, auth=auth)
+        return auth._replace(userId=user['userId'], userAuthToken=user['userAuthToken']), user['isSubscriber']
 
     @property
     def explicit_content_filter_state(self):
@@ -326,13 +580,52 @@ class Pandora:
         self.json_call('user.setExplicitContentFilter', {'isExplicitContentFilterEnabled': state})
         logging.info('Explicit Content Filter set to: %s' %(state))
 
+    def get_cached_station(self, station_id):
+        """Returns the Station with station_id from the station list cached for the user or None
+
+        Unlike :py:meth:`get_station_by_id` this doesn't need :py:meth:`get_stations` to have run.
+        """
+        cached = self.station_lists.get(self.userId)
+        if cached is not None:
+            for i in cached['stations']:
+                if i['stationId'] == station_id:
+                    return Station(self, i)
+        return None
+
     def get_stations(self, *ignore):
-        stations = self.json_call(
-            'user.getStationList',
-            {'returnAllStations': True}
-        )['stations']
+        """Get the user's stations and populate :py:attr:`stations`
+
+        The station list is only downloaded if its checksum differs from
+        the one stored in :py:attr:`station_lists` for this user. If it is
+        the same as the list we already have in :py:attr:`stations` that
+        list is returned as is, so callers can tell nothing changed.
+        """
+        cached = self.station_lists.get(self.userId)
+        if cached is not None:
+            checksum = self.json_call('user.getStationListChecksum')['checksum']
+            if checksum != cached['checksum']:
+                cached = None
+            elif checksum == self.stations_checksum:
+                logging.info("Station list unchanged")
+                return self.stations
+            else:
+                logging.info("Using cached station list")
+
+        if cached is None:
+            cached = self.json_call(
+                'user.getStationList',
+                {'returnAllStations': True}
+            )
+            cached = {'checksum': cached.get('checksum'), 'stations': cached['stations']}
+            if cached['checksum']:
+                self.station_lists[self.userId] = cached
+
+        stations = cached['stations']
+        self.stations_checksum = cached['checksum']
         self.quickMixStationIds = None
         self.stations = [Station(self, i) for i in stations]
+        self._stations_by_id = {i.id: i for i in self.stations}
+        self._stations_by_token = {i.idToken: i for i in self.stations}
 
         if self.quickMixStationIds:
             for i in self.stations:
@@ -361,30 +654,39 @@ class Pandora:
 
         return l
 
+    def add_station(self, station):
+        """Add station to :py:attr:`stations` unless a station with the same id is already there"""
+        if station.id not in self._stations_by_id:
+            self.stations.append(station)
+            self._stations_by_id[station.id] = station
+            self._stations_by_token[station.idToken] = station
+
     def add_station_by_music_id(self, musicid):
         d = self.json_call('station.createStation', {'musicToken': musicid})
         station = Station(self, d)
-        if not self.get_station_by_id(station.id):
-            self.stations.append(station)
+        self.add_station(station)
         return station
 
     def add_station_by_track_token(self, trackToken, musicType):
         d = self.json_call('station.createStation', {'trackToken': trackToken, 'musicType': musicType})
         station = Station(self, d)
-        if not self.get_station_by_id(station.id):
-            self.stations.append(station)
+        self.add_station(station)
         return station
 
     def delete_station(self, station):
-        if self.get_station_by_id(station.id):
+        station = self.get_station_by_id(station.id)
+        if station:
             logging.info("pandora: Deleting Station")
             self.json_call('station.deleteStation', {'stationToken': station.idToken})
             self.stations.remove(station)
+            del self._stations_by_id[station.id]
+            del self._stations_by_token[station.idToken]
 
     def get_station_by_id(self, id):
-        for i in self.stations:
-            if i.id == id:
-                return i
+        return self._stations_by_id.get(id)
+
+    def get_station_by_token(self, token):
+        return self._stations_by_token.get(token)
 
     def add_feedback(self, trackToken, rating):
         logging.info("pandora: addFeedback")
@@ -396,6 +698,8 @@ class Pandora:
         self.json_call('station.deleteFeedback', {'feedbackId': feedbackId, 'stationToken': stationToken})
 
 class Station:
+    __slots__ = ('pandora', 'id', 'idToken', 'isCreator', 'isQuickMix', 'isThumbprint', 'name', 'useQuickMix')
+
     def __init__(self, pandora, d):
         self.pandora = pandora
 
@@ -422,11 +726,18 @@ class Station:
         # It is better that a playlist be considered invalid a fraction
         # of a sec early than be considered valid any longer than it actually is.
         playlist_time = time.time()
-        playlist = self.pandora.json_call('station.getPlaylist', {
-                        'stationToken': self.idToken,
-                        'includeTrackLength': True,
-                        'additionalAudioUrl': 'HTTP_32_AACPLUS,HTTP_128_MP3',
-                    }, https=True)['items']
+        self.pandora.playlist_requests.append(playlist_time)
+        try:
+            playlist = self.pandora.json_call('station.getPlaylist', {
+                            'stationToken': self.idToken,
+                            'includeTrackLength': True,
+                            'additionalAudioUrl': 'HTTP_32_AACPLUS,HTTP_128_MP3',
+                        }, https=True)['items']
+        except PandoraError as e:
+            if e.status == ApiError.PLAYLIST_EXCEEDED:
+                # Use up the budget so nothing is fetched ahead of time for a while.
+                self.pandora.playlist_requests.extend([playlist_time] * PLAYLIST_BUDGET)
+            raise
 
         return [Song(self.pandora, i, playlist_time) for i in playlist if 'songName' in i] 
 
@@ -434,6 +745,20 @@ class Station:
     def info_url(self):
         return 'http://www.pandora.com/stations/'+self.idToken
 
+    def to_dict(self):
+        """Returns the station as a user.getStationList item
+
+        Station(pandora, station.to_dict()) recreates it.
+        """
+        return {
+            'stationId': self.id,
+            'stationToken': self.idToken,
+            'isShared': not self.isCreator,
+            'isQuickMix': self.isQuickMix,
+            'isThumbprint': self.isThumbprint,
+            'stationName': self.name,
+        }
+
     def rename(self, new_name):
         if new_name != self.name:
             self.transformIfShared()
@@ -453,6 +778,15 @@ class Station:
         )
 
 class Song:
+    # Songs stick around in the songs model for the whole session, so keep them small.
+    # index, art_pixbuf, duration_message and the quality and bitrate it's played at are set by PithosWindow.
+    __slots__ = (
+        'pandora', 'playlist_time', 'is_ad', 'tired', 'message', 'duration', 'position', 'bitrate', 'quality',
+        'start_time', 'finished', 'feedbackId', 'artUrl', 'album', 'artist', 'trackToken', 'rating',
+        'stationId', 'songName', 'songDetailURL', 'songExplorerUrl', 'artRadio', 'trackLength',
+        'trackGain', 'audioUrlMap', 'title', 'title_resolved', 'index', 'art_pixbuf', 'duration_message',
+    )
+
     def __init__(self, pandora, d, playlist_time):
         self.pandora = pandora
         self.playlist_time = playlist_time
@@ -462,11 +796,14 @@ class Song:
         self.duration = None
         self.position = None
         self.bitrate = None
+        self.quality = None
         self.start_time = None
         self.finished = False
         self.feedbackId = None
-        self.bitrate = None
         self.artUrl = None
+        self.index = None
+        self.art_pixbuf = None
+        self.duration_message = None
         self.album = d['albumName']
         self.artist = d['artistName']
         self.trackToken = d['trackToken']
@@ -478,25 +815,18 @@ class Song:
         self.artRadio = d['albumArtUrl']
         self.trackLength = d['trackLength']
         self.trackGain = float(d.get('trackGain', '0.0'))
-        self.audioUrlMap = d['audioUrlMap']
+        self.audioUrlMap = {quality: AudioUrl(i['encoding'], i['bitrate'], i['audioUrl'])
+                            for quality, i in d['audioUrlMap'].items()}
 
         # Optionally we requested more URLs
         if len(d.get('additionalAudioUrl', [])) == 2:
-            if int(self.audioUrlMap['highQuality']['bitrate']) < 128:
+            if int(self.audioUrlMap['highQuality'].bitrate) < 128:
                 # We can use the higher quality mp3 stream for non-one users
                 self.audioUrlMap['mediumQuality'] = self.audioUrlMap['highQuality']
-                self.audioUrlMap['highQuality'] = {
-                    'encoding': 'mp3',
-                    'bitrate': '128',
-                    'audioUrl': d['additionalAudioUrl'][1],
-                }
+                self.audioUrlMap['highQuality'] = AudioUrl('mp3', '128', d['additionalAudioUrl'][1])
             else:
                 # And we can offer a lower bandwidth option for one users
-                self.audioUrlMap['lowQuality'] = {
-                    'encoding': 'aacplus',
-                    'bitrate': '32',
-                    'audioUrl': d['additionalAudioUrl'][0],
-                }
+                self.audioUrlMap['lowQuality'] = AudioUrl('aacplus', '32', d['additionalAudioUrl'][0])
 
         # the actual name of the track, minus any special characters (except dashes) is stored
         # as the last part of the songExplorerUrl, before the args.
@@ -504,31 +834,84 @@ class Song:
         clean_expl_name = NAME_COMPARE_REGEX.sub('', explorer_name).lower()
         clean_name = NAME_COMPARE_REGEX.sub('', self.songName).lower()
 
-        if clean_name == clean_expl_name:
-            self.title = self.songName
-        else:
-            try:
-                with urllib.request.urlopen(self.songExplorerUrl) as x, minidom.parseString(x.read()) as dom:
-                    attr_value = dom.getElementsByTagName('songExplorer')[0].attributes['songTitle'].value
-
-                # Pandora stores their titles for film scores and the like as 'Score name: song name'
-                self.title = attr_value.replace('{0}: '.format(self.songName), '', 1)
-            except:
-                self.title = self.songName
+        # If they don't match the real title has to be looked up with resolve_title(),
+        # until then (or if that fails) we just use the songName.
+        self.title = self.songName
+        self.title_resolved = clean_name == clean_expl_name
+        if not self.title_resolved:
+            cached_title = self.pandora.song_titles.get(self.songExplorerUrl)
+            if cached_title is not None:
+                self.title = cached_title
+                self.title_resolved = True
+
+    def resolve_title(self):
+        """Look up the real title of the song from its songExplorerUrl
+
+        This blocks on the network, so call it from a worker thread.
+        Returns True if the title changed.
+        """
+        if self.title_resolved:
+            return False
+        try:
+            with urllib.request.urlopen(self.songExplorerUrl, timeout=TITLE_LOOKUP_TIMEOUT) as x:
+                data = x.read()
+            self.pandora.count_bytes(len(data))
+            with minidom.parseString(data) as dom:
+                attr_value = dom.getElementsByTagName('songExplorer')[0].attributes['songTitle'].value
+        except Exception as e:
+            logging.info("Failed to look up title of %s: %s", self.songName, e)
+            return False
+        finally:
+            self.title_resolved = True
+
+        # Pandora stores their titles for film scores and the like as 'Score name: song name'
+        title = attr_value.replace('{0}: '.format(self.songName), '', 1)
+        self.pandora.song_titles[self.songExplorerUrl] = title
+        if title == self.title:
+            return False
+        self.title = title
+        return True
+
+    def to_dict(self):
+        """Returns the song as a station.getPlaylist item
+
+        Song(pandora, song.to_dict(), song.playlist_time) recreates it.
+        """
+        return {
+            'albumName': self.album,
+            'artistName': self.artist,
+            'trackToken': self.trackToken,
+            'songRating': 1 if self.rating == RATE_LOVE else 0,
+            'stationId': self.stationId,
+            'songName': self.songName,
+            'songDetailUrl': self.songDetailURL,
+            'songExplorerUrl': self.songExplorerUrl,
+            'albumArtUrl': self.artRadio,
+            'trackLength': self.trackLength,
+            'trackGain': str(self.trackGain),
+            'audioUrlMap': {quality: dict(i._asdict()) for quality, i in self.audioUrlMap.items()},
+        }
+
+    def audio_stream(self, quality=None):
+        """Returns (quality, AudioUrl) of the stream to play at quality
+
+        quality defaults to :py:attr:`Pandora.audio_quality`. If the song doesn't
+        have it the next lower quality is used. This doesn't change the song.
+        """
+        if quality is None:
+            quality = self.pandora.audio_quality
+        if quality not in self.audioUrlMap:
+            # Rather go lower than higher, the quality may have been lowered for a slow connection.
+            lower = AUDIO_QUALITIES[:AUDIO_QUALITIES.index(quality)] if quality in AUDIO_QUALITIES else ()
+            available = [i for i in AUDIO_QUALITIES if i in self.audioUrlMap] or list(self.audioUrlMap)
+            fallback = next((i for i in reversed(lower) if i in self.audioUrlMap), available[0])
+            logging.warning("Unable to use audio format %s. Using %s", quality, fallback)
+            quality = fallback
+        return quality, self.audioUrlMap[quality]
 
     @property
     def audioUrl(self):
-        quality = self.pandora.audio_quality
-        try:
-            q = self.audioUrlMap[quality]
-            self.bitrate = q['bitrate']
-            logging.info("Using audio quality %s: %s %s", quality, q['bitrate'], q['encoding'])
-            return q['audioUrl']
-        except KeyError:
-            logging.warning("Unable to use audio format %s. Using %s",
-                           quality, list(self.audioUrlMap.keys())[0])
-            self.bitrate = list(self.audioUrlMap.values())[0]['bitrate']
-            return list(self.audioUrlMap.values())[0]['audioUrl']
+        return self.audio_stream()[1].audioUrl
 
     @property
     def station(self):
@@ -594,6 +977,8 @@ class Song:
 
 
 class SearchResult:
+    __slots__ = ('resultType', 'score', 'musicId', 'title', 'artist', 'name', 'stationName')
+
     def __init__(self, resultType, d):
         self.resultType = resultType
         self.score = d['score']
@@ -14,7 +14,6 @@
 
 
 import contextlib
-import hashlib
 import html
 import json
 import logging
@@ -26,6 +25,7 @@ import time
 import urllib.error
 import urllib.parse
 import urllib.request
+from collections import Counter, namedtuple
 from enum import Enum
 
 import gi
@@ -39,11 +39,16 @@ if Gtk.get_major_version() < 3 or Gtk.get_minor_version() < 14:
 
 from . import AboutPithosDialog, PreferencesPithosDialog, StationsDialog
 from .StationsPopover import StationsPopover
-from .gobject_worker import GObjectWorker
+from .gobject_worker import GObjectWorker, JobGroup, Priority
+from .playlist_cache import PlaylistCache
+from .art_cache import ArtCache, ThumbnailCache, album_key, variant_url
+from .audio_spool import AudioSpool
+from .adaptive_quality import AdaptiveQuality
+from .song_history import evict_song_history
 from .pandora import *
 from .pandora.data import *
 from .plugin import load_plugins
-from .util import parse_proxy, open_browser, SecretService, popup_at_pointer, is_flatpak
+from .util import parse_proxy, open_browser, SecretService, popup_at_pointer, is_flatpak, JsonFileCache, BandwidthMeter
 from .migrate_settings import maybe_migrate_settings
 
 try:
@@ -61,8 +66,40 @@ except AttributeError:
 
 ALBUM_ART_SIZE = 96
 TEXT_X_PADDING = 12
-# 15 days in seconds to retain album art files.
+# 15 days in seconds to retain album art files that weren't used.
 ART_CACHE_TIME = 1.296e+6
+# Bytes of album art files to keep, least recently used ones are removed first.
+ART_CACHE_SIZE = 50*1024*1024
+# Seconds between removing old album art files.
+ART_CACHE_EVICT_INTERVAL = 15*60
+# Number of decoded album art thumbnails to keep in memory.
+THUMBNAIL_CACHE_SIZE = 100
+# Bytes of the evicted song history log before it is rotated.
+SONG_HISTORY_LOG_SIZE = 1024*1024
+# Bytes of prefetched audio to keep in the temporary directory.
+AUDIO_SPOOL_SIZE = 32*1024*1024
+# Highest 'playlist-lookahead' on metered connections.
+METERED_LOOKAHEAD = 1
+# Seconds between logging the bandwidth used in the last hour.
+BANDWIDTH_LOG_INTERVAL = 15*60
+# Seconds to wait before each attempt to reopen a song after a network error.
+RECOVERY_BACKOFF = (1, 2, 4, 8, 16)
+# Seconds to wait for album art downloads.
+ART_DOWNLOAD_TIMEOUT = 15
+# Number of looked up song titles to remember.
+SONG_TITLE_CACHE_SIZE = 2000
+# Seconds to batch changes to the song titles before writing them.
+SONG_TITLE_SAVE_DELAY = 60
+# Number of accounts to remember the station list of.
+STATION_LIST_CACHE_SIZE = 4
+# Seconds to wait before retrying an auth token refresh that failed on the network.
+AUTH_REFRESH_RETRY_TIME = 60
+# Number of stations and bytes of songs and album art to keep unplayed songs for.
+PLAYLIST_CACHE_STATIONS = 10
+PLAYLIST_CACHE_SIZE = 2*1024*1024
+
+# What playbin is given to play a song, see PithosWindow.song_source()
+SongSource = namedtuple('SongSource', ('song', 'uri', 'quality', 'bitrate', 'encoding'))
 
 FALLBACK_BLACK = Gdk.RGBA(red=0.0, green=0.0, blue=0.0, alpha=1.0)
 FALLBACK_WHITE = Gdk.RGBA(red=1.0, green=1.0, blue=1.0, alpha=1.0)
@@ -256,6 +293,7 @@ class PithosWindow(Gtk.ApplicationWindow):
 
         self.settings = Gio.Settings.new('io.github.Pithos')
         self.settings.connect('changed::audio-quality', self.set_audio_quality)
+        self.settings.connect('changed::metered-data-saver', self.update_metered)
         self.settings.connect('changed::proxy', self.set_proxy)
         self.settings.connect('changed::control-proxy', self.set_proxy)
         self.settings.connect('changed::control-proxy-pac', self.set_proxy)
@@ -272,8 +310,21 @@ class PithosWindow(Gtk.ApplicationWindow):
         load_plugins(self)
 
         self.pandora = make_pandora(test_mode)
+        self.pandora.bandwidth = self.bandwidth
+        self.pandora.song_titles = JsonFileCache(
+            os.path.join(self.cachedir, 'song_titles.json'),
+            max_entries=SONG_TITLE_CACHE_SIZE,
+        )
+        self.song_titles_save_timer_id = 0
+        self.pandora.station_lists = JsonFileCache(
+            os.path.join(self.cachedir, 'station_lists.json'),
+            max_entries=STATION_LIST_CACHE_SIZE,
+        )
         self.set_proxy(reconnect=False)
         self.set_audio_quality()
+        # Unplayed songs of the last session, see save_queue()
+        self.queue_snapshot = JsonFileCache(os.path.join(self.cachedir, 'queue.json'))
+        self.resume_queue()
         SecretService.unlock_keyring(self.on_keyring_unlocked)
 
     def on_keyring_unlocked(self, error):
@@ -286,7 +337,7 @@ class PithosWindow(Gtk.ApplicationWindow):
 
         else:
             maybe_migrate_settings()
-            self.pandora_connect()
+            self.pandora_connect(resume=True)
 
 
     def init_core(self):
@@ -338,19 +389,34 @@ class PithosWindow(Gtk.ApplicationWindow):
         bus.connect("message::buffering", self.on_gst_buffering)
         bus.connect("message::error", self.on_gst_error)
         bus.connect("message::element", self.on_gst_element)
+        bus.connect("message::async-done", self.on_gst_async_done)
         self.player.connect("notify::volume", self.on_gst_volume)
         self.player.connect("notify::source", self.on_gst_source)
+        self.player.connect("about-to-finish", self.on_gst_about_to_finish)
 
         self.stations_dlg = None
 
         self._current_state = PseudoGst.STOPPED
         self._buffer_recovery_state = PseudoGst.STOPPED
+        # The song playbin should continue with when the current one finishes,
+        # picked on the main thread for on_gst_about_to_finish.
+        self.gapless_song = None
+        # Its SongSource, the only thing on_gst_about_to_finish reads.
+        self.gapless_source = None
+        # The SongSource playbin got in on_gst_about_to_finish.
+        self.queued_source = None
 
         self.current_song_index = None
         self.current_station = None
         self.current_station_id = self.settings['last-station-id']
+        # Station of the songs resumed from the last session while logging in
+        self.resumed_station_id = None
 
         self.filter_state = None
+        # (filter enabled, PIN protected) from user.getSettings, see bootstrap()
+        self.explicit_content_filter_state = None
+        # Set while logging in until audio plays, to log how long that took
+        self.login_start_time = None
         self.auto_retrying_auth = False
         self.have_stations = False
         self.playcount = 0
@@ -360,11 +426,26 @@ class PithosWindow(Gtk.ApplicationWindow):
         self.waiting_for_playlist = False
         self.start_new_playlist = False
         self.buffering_timer_id = 0
+        # Reopening the current song after a network error, see recover_song()
+        self.recovery_timer_id = 0
+        self.recovery_attempts = 0
+        self.recovering_song = None
+        self.pending_seek = None
+        # Where playback of the reopened song resumed, see song_recovered()
+        self.recovery_position = 0
+        self.recovery_stats = Counter()
         self.ui_loop_timer_id = 0
-        self.playlist_update_timer_id = 0
+        self.auth_refresh_timer_id = 0
+        self.saved_session_time = None
+        # auth_time of the login the auth refresh is scheduled for
+        self.scheduled_auth_time = None
         display = self.props.screen.get_display()
         self.not_in_x = not type(display).__name__.endswith('X11Display')
-        self.worker = GObjectWorker()
+        self.worker = GObjectWorker.get_default()
+        # Playlist, album art and title jobs for the current station, see cancel_playlist_jobs()
+        self.playlist_jobs = JobGroup()
+        # Unplayed songs of stations switched away from, see station_changed()
+        self.playlist_cache = PlaylistCache(PLAYLIST_CACHE_STATIONS, PLAYLIST_CACHE_SIZE)
 
         try:
             tempdir_base = '/var/tmp' # Preferred over /tmp as lots of icons can be large in size.
@@ -377,6 +458,32 @@ class PithosWindow(Gtk.ApplicationWindow):
         except IOError as e:
             self.tempdir = None
             logging.warning('Failed to create a temporary directory: {}'.format(e))
+        if self.tempdir:
+            self.art_cache = ArtCache(self.tempdir, ART_CACHE_SIZE, ART_CACHE_TIME)
+            self.clear_art_cache()
+            GLib.timeout_add_seconds(ART_CACHE_EVICT_INTERVAL, self.clear_art_cache)
+        else:
+            self.art_cache = None
+        self.thumbnails = ThumbnailCache(self.art_cache, THUMBNAIL_CACHE_SIZE)
+        # Album keys of full size art being downloaded, see get_full_album_art()
+        self.full_art_downloads = set()
+        self.bandwidth = BandwidthMeter()
+        GLib.timeout_add_seconds(BANDWIDTH_LOG_INTERVAL, self.log_bandwidth)
+        self.network_monitor = Gio.NetworkMonitor.get_default()
+        self.network_monitor.connect('notify::network-metered', self.update_metered)
+        self.metered = self.settings['metered-data-saver'] and self.network_monitor.get_network_metered()
+        # Track tokens of songs played from the audio spool rather than streamed.
+        self.local_songs = set()
+        self.adaptive_quality = AdaptiveQuality(self.settings['audio-quality'])
+        self.audio_spool = None
+        if self.tempdir:
+            try:
+                self.audio_spool = AudioSpool(os.path.join(self.tempdir, 'audio'), AUDIO_SPOOL_SIZE, self.bandwidth)
+            except OSError as e:
+                logging.warning('Failed to create the audio spool: {}'.format(e))
+
+        # Unlike tempdir this isn't cleaned up, for small files that should persist.
+        self.cachedir = os.path.join(GLib.get_user_cache_dir(), 'pithos')
 
     @property
     def playing(self):
@@ -481,7 +588,8 @@ class PithosWindow(Gtk.ApplicationWindow):
         app.add_accelerator('<Primary>r', 'win.toggle-station-popover', None)
         action.connect('activate', self.stations_popover.toggle_visibility)
 
-    def worker_run(self, fn, args=(), callback=None, message=None, context='net', errorback=None, user_data=None):
+    def worker_run(self, fn, args=(), callback=None, message=None, context='net', errorback=None, user_data=None,
+                   priority=Priority.USER, group=None):
         if context and message:
             self.statusbar.push(self.statusbar.get_context_id(context), message)
 
@@ -495,6 +603,9 @@ class PithosWindow(Gtk.ApplicationWindow):
                     callback(v, user_data)
                 else:
                     callback(v)
+            if self.pandora.connected and self.pandora.auth_time != self.scheduled_auth_time:
+                # The call logged in again after its token expired.
+                self.schedule_auth_refresh()
 
         def eb(e):
             if context and message:
@@ -503,7 +614,7 @@ class PithosWindow(Gtk.ApplicationWindow):
             def retry_cb():
                 self.auto_retrying_auth = False
                 if fn is not self.pandora.connect:
-                    self.worker_run(fn, args, callback, message, context)
+                    self.worker_run(fn, args, callback, message, context, priority=priority, group=group)
 
             if isinstance(e, PandoraAuthTokenInvalid) and not self.auto_retrying_auth:
                 self.auto_retrying_auth = True
@@ -518,7 +629,7 @@ class PithosWindow(Gtk.ApplicationWindow):
 
         err = errorback or eb
 
-        self.worker.send(fn, args, cb, err)
+        return self.worker.send(fn, args, cb, err, priority, group)
 
     def get_proxy(self):
         """ Get HTTP proxy, first trying preferences then system proxy """
@@ -541,9 +652,11 @@ class PithosWindow(Gtk.ApplicationWindow):
                 self.pandora.set_explicit_content_filter(current_state)
 
             def get_new_playlist(*ignore):
+                self.explicit_content_filter_state = None
                 if current_checkbox_state:
                     logging.info('Getting a new playlist.')
-                    self.waiting_for_playlist = False
+                    self.cancel_playlist_jobs()
+                    self.playlist_cache.clear()
                     self.stop()
                     self.current_song_index = None
                     self.songs_model.clear()
@@ -564,10 +677,10 @@ class PithosWindow(Gtk.ApplicationWindow):
         global_proxy = self.settings['proxy']
         if global_proxy:
             handlers.append(urllib.request.ProxyHandler({'http': global_proxy, 'https': global_proxy}))
-        global_opener = pandora.Pandora.build_opener(*handlers)
-        urllib.request.install_opener(global_opener)
+        # Other traffic streams responses, only Pandora API calls keep connections alive.
+        urllib.request.install_opener(pandora.Pandora.build_opener(*handlers, keep_alive=False))
 
-        control_opener = global_opener
+        control_opener = pandora.Pandora.build_opener(*handlers)
         control_proxy = self.settings['control-proxy']
         control_proxy_pac = self.settings['control-proxy-pac']
 
@@ -601,14 +714,42 @@ class PithosWindow(Gtk.ApplicationWindow):
             self.pandora_connect()
 
     def set_audio_quality(self, *ignore):
-        self.pandora.set_audio_quality(self.settings['audio-quality'])
+        # The setting is the highest quality, it's lowered for slow and metered connections.
+        ceiling = 'lowQuality' if self.metered else self.settings['audio-quality']
+        self.adaptive_quality.set_ceiling(ceiling)
+        self.pandora.set_audio_quality(self.adaptive_quality.quality)
+
+    def update_metered(self, *ignore):
+        metered = self.settings['metered-data-saver'] and self.network_monitor.get_network_metered()
+        if metered == self.metered:
+            return
+        logging.info("Network connection is %s", "metered, saving data" if metered else "not metered")
+        self.metered = metered
+        self.set_audio_quality()
+        self.prefetch_next_song()
+        self.refill_lookahead()
+
+    def log_bandwidth(self):
+        usage = self.bandwidth.per_hour()
+        logging.info("Bytes transferred in the last hour: %s",
+                     ', '.join('{} {}'.format(category, size) for category, size in sorted(usage.items())) or 'none')
+        return True
 
-    def pandora_connect(self, *ignore, message="Logging in...", callback=None):
+    def audio_quality_adapted(self):
+        self.pandora.set_audio_quality(self.adaptive_quality.quality)
+        # Fetch the next song again in the new quality.
+        self.prefetch_next_song()
+
+    @staticmethod
+    def song_bitrates(song):
+        return {quality: int(i.bitrate) for quality, i in song.audioUrlMap.items()}
+
+    def pandora_connect(self, *ignore, message="Logging in...", callback=None, resume=False):
         def cb(password):
             if not password:
                 self.show_preferences()
             else:
-                self._pandora_connect_real(message, callback, email, password)
+                self._pandora_connect_real(message, callback, email, password, resume)
 
         email = self.settings['email']
         if not email:
@@ -616,7 +757,7 @@ class PithosWindow(Gtk.ApplicationWindow):
         else:
             SecretService.get_account_password(email, cb)
 
-    def _pandora_connect_real(self, message, callback, email, password):
+    def _pandora_connect_real(self, message, callback, email, password, resume=False):
         if self.settings['pandora-one']:
             client = client_keys[default_one_client_id]
         else:
@@ -643,21 +784,118 @@ class PithosWindow(Gtk.ApplicationWindow):
             if callback:
                 callback()
 
+        login_start = time.time()
+        if self._current_state is not PseudoGst.PLAYING:
+            self.login_start_time = login_start
+
         def pandora_ready(*ignore):
-            logging.info("Pandora connected")
+            logging.info("Pandora connected after %.3f seconds", time.time() - login_start)
+            self.schedule_auth_refresh()
             if self.settings['pandora-one'] != self.pandora.isSubscriber:
                 self.settings['pandora-one'] = self.pandora.isSubscriber
                 self._pandora_connect_real(message, callback, email, password)
             else:
-                self.worker_run('get_stations', (), on_got_stations, 'Getting stations...', 'login')
+                self.bootstrap(on_got_stations)
+
+        def on_got_session(session):
+            try:
+                resumed = session is not None and self.pandora.resume(*args, json.loads(session))
+            except ValueError:
+                resumed = False
+            if resumed:
+                self.saved_session_time = self.pandora.auth_time
+                pandora_ready()
+            else:
+                self.worker_run('connect', args, pandora_ready, message, 'login')
+
+        if resume and self.settings['resume-session']:
+            SecretService.get_session(email, on_got_session)
+        else:
+            self.worker_run('connect', args, pandora_ready, message, 'login')
+
+    def bootstrap(self, on_got_stations):
+        """Make the requests needed after logging in at the same time
+
+        The station list, the user's settings and the first playlist of the last
+        station don't depend on each other. The station's token is taken from
+        the cached station list. process_stations() keeps the playlist like it
+        does for songs resumed from the last session.
+        """
+        self.worker_run('get_stations', (), on_got_stations, 'Getting stations...', 'login')
+
+        def on_got_settings(state):
+            self.explicit_content_filter_state = state
+
+        def on_settings_error(e):
+            logging.info("Failed to get user settings: %s", getattr(e, 'message', e))
 
-        self.worker_run('connect', args, pandora_ready, message, 'login')
+        self.worker_run(lambda: self.pandora.explicit_content_filter_state, (), on_got_settings,
+                        context=None, errorback=on_settings_error, priority=Priority.BACKGROUND)
+
+        if self.have_stations or self.current_station is not None:
+            return
+        station = self.pandora.get_cached_station(self.current_station_id)
+        if station is None:
+            return
+        logging.info("Getting songs of station %s while getting stations", station.id)
+        self.current_station = station
+        self.resumed_station_id = station.id
+        if len(self.songs_model):
+            self.refill_lookahead()
+        else:
+            self.get_playlist(start = True)
+
+    def save_session(self):
+        """Keep the current login in the keyring so the next start can skip logging in"""
+        if not self.settings['resume-session']:
+            return
+        session = self.pandora.session()
+        if session is None or session['auth_time'] == self.saved_session_time:
+            return
+        self.saved_session_time = session['auth_time']
+        SecretService.set_session(self.settings['email'], json.dumps(session))
+
+    def schedule_auth_refresh(self, delay=None):
+        """Refresh the auth token in the background shortly before it is expected to expire"""
+        if self.auth_refresh_timer_id:
+            GLib.source_remove(self.auth_refresh_timer_id)
+        if delay is None:
+            delay = self.pandora.auth_refresh_in
+            self.scheduled_auth_time = self.pandora.auth_time
+            # Called whenever there is a new login.
+            self.save_session()
+        self.auth_refresh_timer_id = GLib.timeout_add_seconds(max(1, int(delay)), self.refresh_auth)
+
+    def refresh_auth(self):
+        self.auth_refresh_timer_id = 0
+        if not self.pandora.connected:
+            return False
+
+        if self.pandora.auth_refresh_in > 0:
+            # Someone logged in again since this was scheduled.
+            self.schedule_auth_refresh()
+            return False
+
+        def eb(e):
+            if isinstance(e, PandoraNetError):
+                logging.info("Auth token refresh failed, retrying later: %s", e.submsg or e.message)
+                self.schedule_auth_refresh(AUTH_REFRESH_RETRY_TIME)
+            else:
+                # Calls still log in again on their own once the token expires.
+                logging.warning("Auth token refresh failed: %s", getattr(e, 'message', e))
+
+        self.worker_run('refresh_auth', (), lambda *ignore: self.schedule_auth_refresh(),
+                        errorback=eb, priority=Priority.BACKGROUND)
+        return False
 
     def pandora_reconnect(self, prefs_dialog, email_password):
         ''' Stop everything and reconnect '''
         email, password = email_password
         self.stop()
-        self.waiting_for_playlist = False
+        self.cancel_playlist_jobs()
+        self.playlist_cache.clear()
+        self.resumed_station_id = None
+        self.explicit_content_filter_state = None
         self.current_song_index = None
         self.start_new_playlist = False
         self.current_station = None
@@ -680,6 +918,7 @@ class PithosWindow(Gtk.ApplicationWindow):
                 return self.pandora.explicit_content_filter_state
 
             def sync_checkbox(current_state):
+                self.explicit_content_filter_state = current_state
                 self.filter_state, pin_protected = current_state[0], current_state[1]
                 self.prefs_dlg.explicit_content_filter_checkbutton.set_inconsistent(False)
                 self.prefs_dlg.explicit_content_filter_checkbutton.set_active(self.filter_state)
@@ -688,9 +927,13 @@ class PithosWindow(Gtk.ApplicationWindow):
                 else:
                     self.prefs_dlg.explicit_content_filter_checkbutton.set_sensitive(True)
 
-            self.worker_run(get_filter_and_pin_protected_state, (), sync_checkbox)
+            if self.explicit_content_filter_state is not None:
+                sync_checkbox(self.explicit_content_filter_state)
+            else:
+                self.worker_run(get_filter_and_pin_protected_state, (), sync_checkbox)
 
     def process_stations(self, *ignore):
+        self.pandora.station_lists.save()
         self.stations_model.clear()
         self.stations_popover.clear()
         self.current_station = None
@@ -711,7 +954,12 @@ class PithosWindow(Gtk.ApplicationWindow):
         if not selected and len(self.stations_model):
             selected=self.stations_model[0][0]
         if selected:
-            self.station_changed(selected, reconnecting = self.have_stations)
+            # Keep playing the songs resumed from the last session.
+            resumed = selected.id == self.resumed_station_id
+            self.resumed_station_id = None
+            self.station_changed(selected, reconnecting = self.have_stations or resumed)
+            if resumed:
+                self.refill_lookahead()
             self.have_stations = True
             self.emit('stations-processed', self.pandora.stations)
         else:
@@ -723,18 +971,19 @@ class PithosWindow(Gtk.ApplicationWindow):
         if self.current_song_index is not None:
             return self.songs_model[self.current_song_index][0]
 
-    def start_song(self, song_index):
+    def start_song(self, song_index, gapless=False):
         songs_remaining = len(self.songs_model) - song_index
         if songs_remaining <= 0:
             # We don't have this song yet. Get a new playlist.
             return self.get_playlist(start = True)
-        elif songs_remaining == 1:
-            # Preload next playlist so there's no delay
-            self.get_playlist()
 
         prev = self.current_song
 
-        self.stop()
+        if gapless:
+            # playbin already moved on to this song, the previous one played to the end.
+            self.song_ended(prev.duration or prev.trackLength * Gst.SECOND)
+        else:
+            self.stop()
         self.current_song_index = song_index
 
         if prev:
@@ -748,33 +997,127 @@ class PithosWindow(Gtk.ApplicationWindow):
         if self.current_song.tired or self.current_song.rating == RATE_BAN:
             return self.next_song()
 
-        logging.info("Starting song: index = %i"%(song_index))
+        logging.info("Starting song: index = %i%s"%(song_index, " (gapless)" if gapless else ""))
         song = self.current_song
-        audioUrl = song.audioUrl
-        os.environ['PULSE_PROP_media.title'] = song.title
-        os.environ['PULSE_PROP_media.artist'] = song.artist
-        os.environ['PULSE_PROP_media.name'] = '{}: {}'.format(song.artist, song.title)
-        os.environ['PULSE_PROP_media.filename'] = audioUrl
-        self.player.set_property('buffer-size', int(song.bitrate) * 375)
-        self.player.set_property('connection-speed', int(song.bitrate))
-        self.player.set_property("uri", audioUrl)
-        self._set_player_state(PseudoGst.BUFFERING)
+        if not gapless:
+            audioUrl = self.song_uri(song)
+            os.environ['PULSE_PROP_media.title'] = song.title
+            os.environ['PULSE_PROP_media.artist'] = song.artist
+            os.environ['PULSE_PROP_media.name'] = '{}: {}'.format(song.artist, song.title)
+            os.environ['PULSE_PROP_media.filename'] = audioUrl
+            self.player.set_property('buffer-size', int(song.bitrate) * 375)
+            self.player.set_property('connection-speed', int(song.bitrate))
+            self.player.set_property("uri", audioUrl)
+            if audioUrl.startswith('file:'):
+                # Prefetched songs don't buffer, so nothing else would start them.
+                self.play(change_gst_state=True)
+            else:
+                self._set_player_state(PseudoGst.BUFFERING)
         self.playcount += 1
 
         self.current_song.start_time = time.time()
         self.songs_treeview.scroll_to_cell(song_index, use_align=True, row_align = 1.0)
         self.songs_treeview.set_cursor(song_index, None, 0)
         self.set_title("%s by %s - Pithos" % (song.title, song.artist))
+        self.get_full_album_art(song)
 
         self.update_song_row()
 
         self.emit('song-changed', song)
         self.emit('metadata-changed', song)
 
+        self.save_queue()
+        # Preload the next playlist so there's no delay
+        self.refill_lookahead()
+        self.evict_song_history()
+        self.update_gapless_song()
+        self.prefetch_next_song()
+
     def next_song(self, *ignore):
         if self.current_song_index is not None:
             self.start_song(self.current_song_index + 1)
 
+    def update_gapless_song(self):
+        """Picks the song to queue in playbin when the current one is about to finish"""
+        self.gapless_song = None
+        if self.current_song_index is not None:
+            for index in range(self.current_song_index + 1, len(self.songs_model)):
+                song = self.songs_model[index][0]
+                # Expired songs are left to next_song so they get marked as such.
+                if not (song.tired or song.rating == RATE_BAN):
+                    if song.is_still_valid():
+                        self.gapless_song = song
+                        # Have the art ready for plugins by the time the song changes.
+                        self.get_full_album_art(song)
+                    break
+        self.update_gapless_source()
+
+    def update_gapless_source(self):
+        # on_gst_about_to_finish runs in a streaming thread, so everything it needs
+        # is worked out here and swapped in with a single assignment.
+        song = self.gapless_song
+        self.gapless_source = self.song_source(song) if song is not None else None
+
+    def song_source(self, song):
+        """Returns the SongSource to play song from, its prefetched file if it is complete"""
+        quality, audio = song.audio_stream()
+        file_url = self.audio_spool.file_url(song.trackToken, audio.audioUrl) if self.audio_spool else None
+        return SongSource(song, file_url or audio.audioUrl, quality, audio.bitrate, audio.encoding)
+
+    def use_song_source(self, source):
+        """Records the quality and bitrate source.song is played at, call it when playbin gets source.uri"""
+        song = source.song
+        song.quality = source.quality
+        song.bitrate = source.bitrate
+        logging.info("Using audio quality %s: %s %s", source.quality, source.bitrate, source.encoding)
+        if source.uri.startswith('file:'):
+            self.local_songs.add(song.trackToken)
+
+    def song_uri(self, song):
+        """Returns the uri to play song from, call it when handing the uri to playbin"""
+        source = self.song_source(song)
+        self.use_song_source(source)
+        return source.uri
+
+    def prefetch_next_song(self):
+        """Downloads the song picked by update_gapless_song in the background
+
+        Other prefetched songs are removed, apart from the current one.
+        Nothing is prefetched on metered connections.
+        """
+        # The quality may have changed.
+        self.update_gapless_source()
+        if not self.audio_spool:
+            return
+        song = None if self.metered else self.gapless_song
+        self.audio_spool.retain({i.trackToken for i in (self.current_song, song) if i})
+        if song is None:
+            return
+        audio = song.audio_stream()[1]
+        audioUrl = audio.audioUrl
+        if not self.audio_spool.wants(song.trackToken, audioUrl):
+            return
+        expected_size = song.trackLength * int(audio.bitrate) * 1000 // 8
+
+        def fetch():
+            start = time.monotonic()
+            size = self.audio_spool.fetch(song.trackToken, audioUrl, expected_size)
+            return size * 8 / 1000 / max(time.monotonic() - start, 0.001)
+
+        def callback(kbps):
+            if song is self.gapless_song:
+                # Play it from the file.
+                self.update_gapless_source()
+            # The download competes with the current song, so this is a conservative estimate.
+            if kbps and self.adaptive_quality.throughput(kbps, self.song_bitrates(song)):
+                self.audio_quality_adapted()
+
+        def errorback(e):
+            logging.info('Failed to prefetch audio, it will be streamed: {}'.format(e))
+
+        self.worker_run(fetch, (), callback, context=None, errorback=errorback,
+                        priority=Priority.BACKGROUND, group=self.playlist_jobs)
+
     def _set_player_state(self, target, change_gst_state=False):
         change_gst_state = change_gst_state or self._current_state is not PseudoGst.BUFFERING
         if change_gst_state:
@@ -787,6 +1130,10 @@ class PithosWindow(Gtk.ApplicationWindow):
             self._current_state = target
             if self._current_state is PseudoGst.PLAYING:
                 self.create_ui_loop()
+                if self.login_start_time is not None:
+                    logging.info("First audio %.3f seconds after logging in started",
+                                 time.time() - self.login_start_time)
+                    self.login_start_time = None
             else:
                 self.destroy_ui_loop()
         if target is not PseudoGst.BUFFERING:
@@ -823,17 +1170,35 @@ class PithosWindow(Gtk.ApplicationWindow):
             self.emit('play-state-changed', False)
 
 
-    def stop(self):
+    def song_ended(self, position):
         prev = self.current_song
         if prev and prev.start_time:
             prev.finished = True
-            prev.position = self.query_position()
+            prev.position = position
             self.emit("song-ended", prev)
+            if self.audio_spool:
+                self.audio_spool.remove(prev.trackToken)
+            if prev.trackToken in self.local_songs:
+                self.local_songs.discard(prev.trackToken)
+            elif position and prev.bitrate:
+                # What GStreamer streamed isn't known, estimate it from what was played.
+                self.bandwidth.add('audio', position // Gst.SECOND * int(prev.bitrate) * 1000 // 8)
+            if position and self.adaptive_quality.played(position // Gst.SECOND, self.song_bitrates(prev)):
+                self.audio_quality_adapted()
+
+    def stop(self):
+        self.song_ended(self.query_position())
 
         if self._set_player_state(PseudoGst.STOPPED, change_gst_state=True):
             # We need to reset the icon at song changes since our default
             # desired state is playing when going to a new song.
             self.playpause_image.set_from_icon_name('media-playback-pause-symbolic', Gtk.IconSize.SMALL_TOOLBAR)
+        # Stopping the pipeline dropped any uri queued for gapless playback.
+        self.gapless_song = None
+        self.gapless_source = None
+        self.queued_source = None
+        self.local_songs.clear()
+        self.cancel_recovery()
 
     def user_playpause(self, *ignore):
         self.playpause_notify()
@@ -852,22 +1217,82 @@ class PithosWindow(Gtk.ApplicationWindow):
             self.user_play()
 
     def clear_art_cache(self):
+        """Remove least recently used and expired album art in the background"""
         logging.info('Checking for expired art in cache')
-        timestamp = time.time()
-        with os.scandir(self.tempdir) as art_list:
-            for art in art_list:
-                age = timestamp - art.stat().st_mtime
-                if age > ART_CACHE_TIME:
-                    os.remove(os.path.join(self.tempdir, art.path))
-
-    def get_playlist(self, start = False):
-        if self.playlist_update_timer_id:
-            GLib.source_remove(self.playlist_update_timer_id)
-        self.playlist_update_timer_id = 0
+
+        def errorback(e):
+            logging.warning('Failed to clean up art cache: {}'.format(e))
+
+        self.worker_run(self.art_cache.evict, (), context=None, errorback=errorback, priority=Priority.BACKGROUND)
+        return True
+
+    @staticmethod
+    def load_album_art(image):
+        """Decodes image data to a pixbuf for the song list"""
+        with contextlib.closing(GdkPixbuf.PixbufLoader()) as loader:
+            loader.set_size(ALBUM_ART_SIZE, ALBUM_ART_SIZE)
+            loader.write(image)
+        return loader.get_pixbuf()
+
+    def get_full_album_art(self, song=None):
+        """Sets song.artUrl to the full size art, downloading it in the background if needed
+
+        Only plugins use it, the song list uses thumbnails. So it is only fetched if an
+        enabled plugin uses it, for the song played and the next one, so it's there
+        when song-changed is emitted. Without song, it is fetched for both of them.
+        """
+        if song is None:
+            for song in (self.current_song, self.gapless_song):
+                if song is not None:
+                    self.get_full_album_art(song)
+            return
+        if song.artUrl or not song.artRadio or not self.art_cache:
+            return
+        if not any(plugin.enabled and plugin.uses_art_url for plugin in self.plugins.values()):
+            return
+        key = album_key(song.artist, song.album)
+        song.artUrl = self.art_cache.file_url(key)
+        if song.artUrl:
+            return
+        if self.metered:
+            # Make do with the song list's thumbnail.
+            song.artUrl = self.art_cache.file_url(key, thumbnail=True)
+            return
+        if key in self.full_art_downloads:
+            return
+        self.full_art_downloads.add(key)
+
+        def download():
+            with urllib.request.urlopen(song.artRadio, timeout=ART_DOWNLOAD_TIMEOUT) as f:
+                image = f.read()
+            self.bandwidth.add('art', len(image))
+            self.art_cache.put(key, image)
+            return self.art_cache.file_url(key)
+
+        def callback(file_url):
+            self.full_art_downloads.discard(key)
+            song.artUrl = file_url
+            if file_url and song is self.current_song:
+                self.emit('metadata-changed', song)
+
+        def errorback(e):
+            self.full_art_downloads.discard(key)
+            logging.warning('Failed to get album art: {}'.format(e))
+
+        # Not in playlist_jobs, a cancelled job would never leave full_art_downloads.
+        self.worker_run(download, (), callback, context=None, errorback=errorback,
+                        priority=Priority.BACKGROUND)
+
+    def get_playlist(self, start = False, cached_songs=None):
         songs_left_to_process = 0
         song_count = 0
+        # Each batch of songs has its own timer, another batch mustn't cancel it.
+        playlist_update_timer_id = 0
         self.start_new_playlist = self.start_new_playlist or start
         if self.waiting_for_playlist: return
+        if self.current_station is None:
+            # Still logging in after resuming the last session, the stations will start it.
+            return
 
         if self.gstreamer_errorcount_1 >= self.playcount and self.gstreamer_errorcount_2 >=1:
             logging.warning("Too many gstreamer errors. Not retrying")
@@ -876,89 +1301,273 @@ class PithosWindow(Gtk.ApplicationWindow):
             return
 
         def emit_songs_added(song_count):
-            self.playlist_update_timer_id = 0
+            nonlocal playlist_update_timer_id
+            playlist_update_timer_id = 0
             self.emit('songs-added', song_count)
             return False
 
-        def get_album_art(url, tmpdir, *extra):
-            try:
-                with urllib.request.urlopen(url) as f:
-                    image = f.read()
-            except urllib.error.HTTPError:
-                logging.warning('Invalid image url received')
-                return (None, None,) + extra
-
-            file_url = None
+        def get_album_art(url, art_cache, *extra):
             song, index = extra
-            if tmpdir:
-                try:
-                    self.clear_art_cache()
-                    filename_hash = hashlib.sha256((song.artist+song.album).encode('utf-8')).hexdigest()+'.jpeg'
-                    cache_file_path = os.path.join(self.tempdir, filename_hash)
-                    file_url = urllib.parse.urljoin('file://', urllib.parse.quote(cache_file_path))
-                    if not os.path.exists(cache_file_path):
-                        with open(cache_file_path, 'xb') as f:
-                            f.write(image)
-                except IOError:
-                    logging.warning("Failed to write art tempfile")
-
-            with contextlib.closing(GdkPixbuf.PixbufLoader()) as loader:
-                loader.set_size(ALBUM_ART_SIZE, ALBUM_ART_SIZE)
-                loader.write(image)
-            return (loader.get_pixbuf(), file_url,) + extra
+            key = album_key(song.artist, song.album)
+            file_url = art_cache.file_url(key) if art_cache else None
+            pixbuf = self.thumbnails.get(key)
+            if pixbuf is not None:
+                return (pixbuf, file_url,) + extra
+
+            image = art_cache.get(key, thumbnail=True) if art_cache else None
+            if image is None:
+                # Only the full size image has to be stored if the smaller one can't be had.
+                thumbnail_url = variant_url(url, ALBUM_ART_SIZE)
+                for art_url in (thumbnail_url, url) if thumbnail_url != url else (url,):
+                    try:
+                        with urllib.request.urlopen(art_url, timeout=ART_DOWNLOAD_TIMEOUT) as f:
+                            image = f.read()
+                        self.bandwidth.add('art', len(image))
+                        break
+                    except urllib.error.HTTPError:
+                        logging.warning('Invalid image url received')
+                else:
+                    return (None, None,) + extra
+                if art_cache:
+                    art_cache.put(key, image, thumbnail=art_url != url)
+                    file_url = art_cache.file_url(key)
+
+            pixbuf = self.thumbnails.put(key, self.load_album_art(image))
+            return (pixbuf, file_url,) + extra
 
         def art_callback(t):
             nonlocal songs_left_to_process
             pixbuf, file_url, song, index = t
             songs_left_to_process -= 1
-            if index<len(self.songs_model) and self.songs_model[index][0] is song: # in case the playlist has been reset
+            if self.song_in_model(song): # in case the playlist has been reset or the song evicted
                 logging.info("Downloaded album art for %i"%song.index)
                 song.art_pixbuf = pixbuf
-                self.songs_model[index][3]=pixbuf
+                self.songs_model[song.index][3]=pixbuf
                 self.update_song_row(song)
                 if file_url:
                     song.artUrl = file_url
                     # The song is either the current song or we got the cover after
                     # after the timeout has expired.
-                    if song is self.current_song or not self.playlist_update_timer_id:
+                    if song is self.current_song or not playlist_update_timer_id:
                         self.emit('metadata-changed', song)
                 # We tried to get covers for all the songs in the playlist,
                 # and the timeout is still live. Cancel it and emit
                 # a 'songs-added' signal.
-                if not songs_left_to_process and self.playlist_update_timer_id:
-                    GLib.source_remove(self.playlist_update_timer_id)
+                if not songs_left_to_process and playlist_update_timer_id:
+                    GLib.source_remove(playlist_update_timer_id)
                     emit_songs_added(song_count)
 
+        def title_callback(changed, song):
+            if changed and not self.song_titles_save_timer_id:
+                self.song_titles_save_timer_id = GLib.timeout_add_seconds(SONG_TITLE_SAVE_DELAY,
+                                                                          self.save_song_titles)
+            if changed and self.song_in_model(song):
+                logging.info("Resolved title for %i"%song.index)
+                self.update_song_row(song)
+                if song is self.current_song:
+                    self.set_title("%s by %s - Pithos" % (song.title, song.artist))
+                self.emit('metadata-changed', song)
+
         def callback(l):
             nonlocal songs_left_to_process
             nonlocal song_count
+            nonlocal playlist_update_timer_id
             songs_left_to_process = song_count = len(l)
             start_index = len(self.songs_model)
             for i in l:
                 i.index = len(self.songs_model)
-                self.songs_model.append((i, '', None, None))
+                self.songs_model.append((i, '', None, i.art_pixbuf))
                 self.update_song_row(i)
-                i.art_pixbuf = None
-                if i.artRadio:
-                    self.worker_run(get_album_art, (i.artRadio, self.tempdir, i, i.index), art_callback)
+                if not i.title_resolved:
+                    self.worker_run(i.resolve_title, (), title_callback, context=None, user_data=i,
+                                    priority=Priority.BACKGROUND, group=self.playlist_jobs)
+                # Cached songs may already have their art.
+                if i.art_pixbuf is None and i.artRadio:
+                    self.worker_run(get_album_art, (i.artRadio, self.art_cache, i, i.index), art_callback,
+                                    priority=Priority.BACKGROUND, group=self.playlist_jobs)
                 else:
                     songs_left_to_process -= 1
-            # Give Pandora about 1 secs per song to return the playlist's cover art
-            # after that emit a 'songs-added' Anyway. We can't wait forever after all.
-            self.playlist_update_timer_id = GLib.timeout_add_seconds(song_count, emit_songs_added, song_count)
+            if songs_left_to_process:
+                # Give Pandora about 1 secs per song to return the playlist's cover art
+                # after that emit a 'songs-added' Anyway. We can't wait forever after all.
+                playlist_update_timer_id = GLib.timeout_add_seconds(song_count, emit_songs_added, song_count)
+            else:
+                # All the songs already have their art, e.g. they came from the playlist cache.
+                emit_songs_added(song_count)
 
-            self.statusbar.pop(self.statusbar.get_context_id('net'))
-            if self.start_new_playlist:
+            if self.waiting_for_playlist:
+                self.statusbar.pop(self.statusbar.get_context_id('net'))
+            # Reset these before starting the song, so a playlist request made
+            # by start_song() (e.g. refilling the look-ahead) isn't forgotten and sent twice.
+            self.waiting_for_playlist = False
+            start, self.start_new_playlist = self.start_new_playlist, False
+            if start:
                 self.start_song(start_index)
 
             self.gstreamer_errorcount_2 = self.gstreamer_errorcount_1
             self.gstreamer_errorcount_1 = 0
             self.playcount = 0
-            self.waiting_for_playlist = False
-            self.start_new_playlist = False
+            if l:
+                self.refill_lookahead()
+                self.update_gapless_song()
+                self.prefetch_next_song()
+
+        if cached_songs:
+            callback(cached_songs)
+            return
 
         self.waiting_for_playlist = True
-        self.worker_run(self.current_station.get_playlist, (), callback, "Getting songs...")
+        self.worker_run(self.current_station.get_playlist, (), callback, "Getting songs...",
+                        priority=Priority.PLAYLIST, group=self.playlist_jobs)
+
+    def evict_song_history(self):
+        """Remove played songs beyond 'song-history' from songs_model, see song_history.evict_song_history()"""
+        if self.current_song_index is None:
+            return
+        evicted = evict_song_history(self.songs_model, self.current_song_index, self.settings['song-history'])
+        if not evicted:
+            return
+
+        self.current_song_index -= len(evicted)
+        if self.settings['song-history-log']:
+            self.log_song_history(evicted)
+        logging.debug("Evicted %i songs from the history", len(evicted))
+
+    def log_song_history(self, songs):
+        """Append songs evicted from songs_model to a log in the cache directory"""
+        path = os.path.join(self.cachedir, 'history.log')
+        try:
+            if os.path.getsize(path) > SONG_HISTORY_LOG_SIZE:
+                os.replace(path, path + '.1')
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning('Failed to rotate song history: {}'.format(e))
+        try:
+            os.makedirs(self.cachedir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                for song in songs:
+                    f.write(json.dumps({
+                        'time': int(song.start_time or 0),
+                        'stationId': song.stationId,
+                        'artist': song.artist,
+                        'title': song.title,
+                        'album': song.album,
+                        'rating': song.rating,
+                        'trackToken': song.trackToken,
+                    }) + '\n')
+        except OSError as e:
+            logging.warning('Failed to write song history: {}'.format(e))
+
+    def save_queue(self):
+        """Save the unplayed songs so the next start can play them while logging in"""
+        if self.current_station is not None:
+            station_id = self.current_station.id
+            self.queue_snapshot['station'] = self.current_station.to_dict()
+        else:
+            station_id = self.resumed_station_id
+        if station_id is None:
+            return
+        self.queue_snapshot['station_id'] = station_id
+        self.queue_snapshot['songs'] = [
+            {'song': song.to_dict(), 'playlist_time': song.playlist_time}
+            for song in self.unplayed_songs() if song.is_still_valid()
+        ]
+        self.queue_snapshot.save()
+
+    def resume_queue(self):
+        """Start playing the songs saved by save_queue() without waiting for the login"""
+        saved_songs = self.queue_snapshot.pop('songs', ())
+        if self.queue_snapshot.get('station_id') != self.current_station_id:
+            return
+        # Never play them twice.
+        self.queue_snapshot.save()
+
+        songs = []
+        for i in saved_songs:
+            try:
+                song = Song(self.pandora, i['song'], i['playlist_time'])
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning('Ignoring invalid saved song: {}'.format(e))
+                continue
+            if not song.is_still_valid():
+                continue
+            key = album_key(song.artist, song.album)
+            song.art_pixbuf = self.thumbnails.get(key)
+            image = self.art_cache.get(key, thumbnail=True) if self.art_cache and song.art_pixbuf is None else None
+            if image is not None:
+                try:
+                    song.art_pixbuf = self.thumbnails.put(key, self.load_album_art(image))
+                except GLib.Error:
+                    pass
+            songs.append(song)
+        if not songs:
+            return
+
+        logging.info('Resuming {} songs of station {}'.format(len(songs), self.current_station_id))
+        self.resumed_station_id = self.current_station_id
+        # Rating the songs needs their station before the station list is loaded,
+        # get_stations() replaces it.
+        try:
+            self.pandora.add_station(Station(self.pandora, self.queue_snapshot['station']))
+        except (KeyError, TypeError) as e:
+            logging.warning('Ignoring invalid saved station: {}'.format(e))
+        for song in songs:
+            song.index = len(self.songs_model)
+            self.songs_model.append((song, '', None, song.art_pixbuf))
+            self.update_song_row(song)
+        self.start_song(0)
+
+    def unplayed_songs(self):
+        """Playable songs queued after the current one that were never started"""
+        first = 0 if self.current_song_index is None else self.current_song_index + 1
+        songs = []
+        for i in range(first, len(self.songs_model)):
+            song = self.songs_model[i][0]
+            if not song.tired and song.rating != RATE_BAN and not song.start_time:
+                songs.append(song)
+        return songs
+
+    def lookahead_depth(self):
+        """Number of playable songs queued after the current one"""
+        first = 0 if self.current_song_index is None else self.current_song_index + 1
+        depth = 0
+        for i in range(first, len(self.songs_model)):
+            song = self.songs_model[i][0]
+            if not song.tired and song.rating != RATE_BAN and song.is_still_valid():
+                depth += 1
+        return depth
+
+    def refill_lookahead(self):
+        """Fetch more songs in the background if fewer than 'playlist-lookahead' are queued"""
+        if self.waiting_for_playlist or self.current_station is None:
+            return
+        lookahead = self.settings['playlist-lookahead']
+        if self.metered:
+            lookahead = min(lookahead, METERED_LOOKAHEAD)
+        depth = self.lookahead_depth()
+        if depth >= lookahead:
+            return
+        if depth and not self.pandora.playlist_budget_left():
+            logging.info("Playlist budget used up, not fetching songs ahead of time")
+            return
+        logging.debug("Look-ahead queue has %i songs, fetching more", depth)
+        self.get_playlist()
+
+    def cancel_playlist_jobs(self):
+        """Drop pending playlist, album art and title jobs, their results would be thrown away"""
+        self.playlist_jobs.cancel()
+        self.playlist_jobs = JobGroup()
+        if self.waiting_for_playlist is True:
+            # The cancelled playlist job won't pop its status message.
+            self.statusbar.pop(self.statusbar.get_context_id('net'))
+        self.waiting_for_playlist = False
+
+    def save_song_titles(self):
+        """Write the song titles resolved so far, including unchanged ones"""
+        self.song_titles_save_timer_id = 0
+        self.pandora.song_titles.save()
+        return False
 
     def error_dialog(self, message, retry_cb, submsg=None):
         dialog = self.error_dialog_real
@@ -1001,9 +1610,18 @@ class PithosWindow(Gtk.ApplicationWindow):
 
     def station_changed(self, station, reconnecting=False):
         if station is self.current_station: return
-        self.waiting_for_playlist = False
+        if not reconnecting:
+            self.cancel_playlist_jobs()
+        elif self.have_stations:
+            # Playlist requests may have failed while logged out. Otherwise
+            # one from bootstrap() may still be coming.
+            self.waiting_for_playlist = False
+        cached_songs = None
         if not reconnecting:
             self.stop()
+            if self.current_station is not None:
+                self.playlist_cache.put(self.current_station.id, self.unplayed_songs())
+            cached_songs = self.playlist_cache.pop(station.id)
             self.current_song_index = None
             self.songs_model.clear()
         logging.info("Selecting station %s; total = %i" % (station.id, len(self.stations_model)))
@@ -1011,7 +1629,7 @@ class PithosWindow(Gtk.ApplicationWindow):
         self.current_station = station
         self.settings.set_string('last-station-id', self.current_station_id)
         if not reconnecting:
-            self.get_playlist(start = True)
+            self.get_playlist(start = True, cached_songs=cached_songs)
         self.stations_label.set_text(station.name)
         self.stations_popover.select_station(station)
         self.emit('station-changed', station)
@@ -1024,7 +1642,7 @@ class PithosWindow(Gtk.ApplicationWindow):
                 return
         # We shouldn't actually add the station to the pandora stations list
         # until we know it's not a duplicate.
-        self.pandora.stations.append(station)
+        self.pandora.add_station(station)
         self.stations_model.insert_with_valuesv(0, (0, 1, 2), (station, station.name, 0))
         self.emit('station-added', station)
         self.station_changed(station)
@@ -1085,6 +1703,12 @@ class PithosWindow(Gtk.ApplicationWindow):
             return True
 
     def on_gst_stream_start(self, bus, message):
+        # playbin started playing the song queued in on_gst_about_to_finish.
+        source, self.queued_source = self.queued_source, None
+        song = source.song if source is not None else None
+        if song is not None and song is not self.current_song and self.song_in_model(song):
+            self.use_song_source(source)
+            self.start_song(song.index, gapless=True)
         # Edge case. We might get this signal while we're reconnecting to Pandora.
         # If so self.current_song will be None.
         if self.current_song is None:
@@ -1097,6 +1721,19 @@ class PithosWindow(Gtk.ApplicationWindow):
         if self.current_song.get_duration_sec() != self.current_song.trackLength:
             self.emit('metadata-changed', self.current_song)
 
+    def on_gst_about_to_finish(self, player):
+        # This is called from a streaming thread and has to set the next uri
+        # before returning, so it only reads the source update_gapless_source picked.
+        # If there is none playbin posts EOS and next_song takes over.
+        source = self.gapless_source
+        if source is None or not source.song.is_still_valid():
+            return
+        logging.info("Queueing next song for gapless playback")
+        player.set_property('buffer-size', int(source.bitrate) * 375)
+        player.set_property('connection-speed', int(source.bitrate))
+        player.set_property("uri", source.uri)
+        self.queued_source = source
+
     def on_gst_eos(self, bus, message):
         logging.info("EOS")
         self.next_song()
@@ -1121,6 +1758,8 @@ class PithosWindow(Gtk.ApplicationWindow):
     def on_gst_error(self, bus, message):
         err, debug = message.parse_error()
         logging.error("Gstreamer error: %s, %s, %s" % (err, debug, err.code))
+        if self.current_song and self.recover_song(err):
+            return
         if self.current_song:
             self.current_song.message = "Error: "+str(err)
             self.update_song_row()
@@ -1131,6 +1770,115 @@ class PithosWindow(Gtk.ApplicationWindow):
         if not GstPbutils.install_plugins_installation_in_progress():
             self.next_song()
 
+    @staticmethod
+    def is_network_error(err):
+        """Whether err is the source failing to read, rather than the song being refused or undecodable"""
+        if err.matches(Gst.ResourceError.quark(), Gst.ResourceError.READ):
+            return True
+        if err.matches(Gst.ResourceError.quark(), Gst.ResourceError.OPEN_READ):
+            # souphttpsrc reports most HTTP errors like this, e.g. "Forbidden (403), URL: ..."
+            # Client errors mean the URL was refused or expired.
+            status = re.search(r'\((\d{3})\)', err.message)
+            return not (status and 400 <= int(status.group(1)) < 500)
+        return False
+
+    def recover_song(self, err):
+        """Schedules reopening the current song where it stopped after a network error
+
+        Returns False if the song should be skipped instead: the error isn't a
+        network error, the song expired or the retries are used up.
+        """
+        song = self.current_song
+        if not self.is_network_error(err) or not song.is_still_valid():
+            return False
+        if self.recovery_attempts >= len(RECOVERY_BACKOFF):
+            self.recovery_stats['gave up'] += 1
+            logging.warning("Giving up on song after %i attempts to reopen it, recoveries: %s",
+                            self.recovery_attempts, dict(self.recovery_stats))
+            self.cancel_recovery()
+            return False
+
+        position = self.query_position() or song.position or 0
+        delay = RECOVERY_BACKOFF[self.recovery_attempts]
+        self.recovery_attempts += 1
+        logging.info("Reopening song at %s in %i seconds, attempt %i",
+                     self.format_time(position), delay, self.recovery_attempts)
+        song.message = "Network error, reconnecting…"
+        self.update_song_row()
+        # Nothing more can come out of the failed pipeline.
+        self.player.set_state(Gst.State.NULL)
+        self._current_state = PseudoGst.STOPPED
+        self.destroy_ui_loop()
+
+        if self.recovery_timer_id:
+            GLib.source_remove(self.recovery_timer_id)
+        self.recovery_timer_id = GLib.timeout_add_seconds(delay, self.reopen_song, song, position)
+        return True
+
+    def reopen_song(self, song, position):
+        self.recovery_timer_id = 0
+        if song is not self.current_song:
+            return False
+        if not song.is_still_valid():
+            song.message = 'Song expired'
+            self.update_song_row()
+            self.next_song()
+            return False
+        self.recovering_song = song
+        # Seeking once the pipeline is paused has the HTTP source resume with a Range request.
+        self.pending_seek = position
+        self.recovery_position = position
+        # Stream it even if it was prefetched, in case the local file was the problem.
+        self.local_songs.discard(song.trackToken)
+        # The same stream as before, so the position to seek to matches.
+        audio = song.audio_stream(song.quality)[1]
+        self.player.set_property("uri", audio.audioUrl)
+        self._set_player_state(PseudoGst.BUFFERING)
+        return False
+
+    def cancel_recovery(self):
+        if self.recovery_timer_id:
+            GLib.source_remove(self.recovery_timer_id)
+            self.recovery_timer_id = 0
+        self.recovery_attempts = 0
+        self.recovering_song = None
+        self.pending_seek = None
+        self.recovery_position = 0
+
+    def on_gst_async_done(self, bus, message):
+        if self.recovering_song is None:
+            return
+        if self.pending_seek is None:
+            # The seek completed, it may have landed before the position asked for.
+            self.recovery_position = self.query_position() or 0
+            return
+        position, self.pending_seek = self.pending_seek, None
+        if position and not self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                                                    position):
+            logging.warning("Failed to seek, playing the song from the start")
+            self.recovery_position = 0
+
+    def song_recovered(self):
+        """Counts the recovery of the current song once it plays past where it was reopened
+
+        Only then are its retries reset, so a stream that fails again right
+        after reopening it runs out of them.
+        """
+        if self.pending_seek is not None or self.recovering_song is None:
+            return
+        position = self.query_position()
+        if not position or position <= self.recovery_position:
+            return
+        song, self.recovering_song = self.recovering_song, None
+        if song is not self.current_song:
+            return
+        self.recovery_stats['recovered'] += 1
+        logging.info("Recovered song after %i attempts, recoveries: %s",
+                     self.recovery_attempts, dict(self.recovery_stats))
+        self.recovery_attempts = 0
+        song.message = ''
+        self.update_song_row()
+
     def on_gst_buffering(self, bus, message):
         # React to the buffer message immediately and also fire a short repeating timeout
         # to check the buffering state that cancels only if we're not buffering or there's a pending timeout.
@@ -1159,6 +1907,8 @@ class PithosWindow(Gtk.ApplicationWindow):
 
         if buffering and self._current_state is not PseudoGst.BUFFERING:
             logging.debug("Buffer underrun")
+            if self._current_state is PseudoGst.PLAYING and self.adaptive_quality.underrun():
+                self.audio_quality_adapted()
             if self._set_player_state(PseudoGst.BUFFERING):
                 logging.debug("Pausing pipeline")
         elif not buffering and self._current_state is PseudoGst.BUFFERING:
@@ -1206,7 +1956,11 @@ class PithosWindow(Gtk.ApplicationWindow):
         if song is self.current_song:
             song.position = self.query_position()
             if not song.bitrate is None:
-                msg.append("%skbit/s" % (song.bitrate))
+                if song.quality != self.adaptive_quality.ceiling and self.adaptive_quality.ceiling in song.audioUrlMap:
+                    # Played below the chosen quality because of a slow connection.
+                    msg.append("%skbit/s (reduced)" % (song.bitrate))
+                else:
+                    msg.append("%skbit/s" % (song.bitrate))
 
             if song.position is not None and song.duration is not None:
                 pos_str = self.format_time(song.position)
@@ -1238,17 +1992,27 @@ class PithosWindow(Gtk.ApplicationWindow):
             return 'ban'
         return None
 
+    def song_in_model(self, song):
+        """Whether song is still in songs_model at song.index"""
+        return (song.index is not None and song.index < len(self.songs_model)
+                and self.songs_model[song.index][0] is song)
+
     def update_song_row(self, song = None):
         if song is None:
             song = self.current_song
-        if song:
+        if song and song.index is not None:
             self.songs_model[song.index][1] = self.song_text(song)
             self.songs_model[song.index][2] = self.song_icon(song)
         return True
 
     def create_ui_loop(self):
         if not self.ui_loop_timer_id:
-            self.ui_loop_timer_id = GLib.timeout_add_seconds(1, self.update_song_row)
+            self.ui_loop_timer_id = GLib.timeout_add_seconds(1, self.ui_loop)
+
+    def ui_loop(self):
+        if self.recovering_song is not None:
+            self.song_recovered()
+        return self.update_song_row()
 
     def destroy_ui_loop(self):
         if self.ui_loop_timer_id:
@@ -1306,6 +2070,9 @@ class PithosWindow(Gtk.ApplicationWindow):
         def callback(l):
             self.update_song_row(song)
             self.emit('metadata-changed', song)
+            if song is self.gapless_song:
+                self.update_gapless_song()
+                self.prefetch_next_song()
         self.worker_run(song.rate, (RATE_BAN,), callback, "Banning song...")
         if song is self.current_song:
             self.next_song()
@@ -1322,6 +2089,9 @@ class PithosWindow(Gtk.ApplicationWindow):
         def callback(l):
             self.update_song_row(song)
             self.emit('metadata-changed', song)
+            if song is self.gapless_song:
+                self.update_gapless_song()
+                self.prefetch_next_song()
         self.worker_run(song.set_tired, (), callback, "Putting song on shelf...")
         if song is self.current_song:
             self.next_song()
@@ -1463,7 +2233,14 @@ class PithosWindow(Gtk.ApplicationWindow):
             self.emit('stations-dlg-ready', True)
 
     def refresh_stations(self, *ignore):
-        self.worker_run(self.pandora.get_stations, (), self.process_stations, "Refreshing stations...")
+        stations = self.pandora.stations
+
+        def callback(new_stations):
+            # get_stations returns the same list if nothing changed.
+            if new_stations is not stations:
+                self.process_stations()
+
+        self.worker_run(self.pandora.get_stations, (), callback, "Refreshing stations...")
 
     def remove_station(self, station):
         def station_index(model, s):
@@ -1508,5 +2285,11 @@ class PithosWindow(Gtk.ApplicationWindow):
     @Gtk.Template.Callback()
     def on_destroy(self, widget, data=None):
         """on_destroy - called when the PithosWindow is close. """
+        self.save_queue()
+        if self.song_titles_save_timer_id:
+            GLib.source_remove(self.song_titles_save_timer_id)
+        self.save_song_titles()
+        if self.art_cache:
+            self.art_cache.index.save()
         self.stop()
         self.quit()
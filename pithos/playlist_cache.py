@@ -0,0 +1,80 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import OrderedDict
+
+# Rough size of a Song and its strings without the album art.
+SONG_SIZE = 2048
+
+
+def song_size(song):
+    """Estimated memory used by song including its decoded album art"""
+    size = SONG_SIZE
+    if song.art_pixbuf is not None:
+        size += song.art_pixbuf.get_byte_length()
+    return size
+
+
+class PlaylistCache:
+    """Unplayed songs of recently played stations
+
+    Lets switching back to a station start playing right away. Songs are
+    dropped once their playlist expires, and whole stations are evicted
+    least recently used first to stay within max_stations and max_bytes.
+    """
+
+    def __init__(self, max_stations, max_bytes):
+        self.max_stations = max_stations
+        self.max_bytes = max_bytes
+        self._playlists = OrderedDict()
+
+    def __len__(self):
+        return len(self._playlists)
+
+    @property
+    def size(self):
+        """Estimated memory used by all cached songs in bytes"""
+        return sum(song_size(song) for songs in self._playlists.values() for song in songs)
+
+    def put(self, station_id, songs):
+        """Remember the unplayed songs of a station, replacing any earlier ones"""
+        self._playlists.pop(station_id, None)
+        songs = [song for song in songs if song.is_still_valid()]
+        if songs:
+            self._playlists[station_id] = songs
+        self._evict()
+
+    def pop(self, station_id):
+        """Returns the still valid songs cached for a station and forgets them"""
+        songs = [song for song in self._playlists.pop(station_id, ()) if song.is_still_valid()]
+        if songs:
+            logging.info('Using {} cached songs for station {}'.format(len(songs), station_id))
+        return songs
+
+    def clear(self):
+        self._playlists.clear()
+
+    def _evict(self):
+        for station_id, songs in list(self._playlists.items()):
+            songs = [song for song in songs if song.is_still_valid()]
+            if songs:
+                self._playlists[station_id] = songs
+            else:
+                del self._playlists[station_id]
+
+        size = self.size
+        while self._playlists and (len(self._playlists) > self.max_stations or size > self.max_bytes):
+            station_id, songs = self._playlists.popitem(last=False)
+            size -= sum(song_size(song) for song in songs)
+            logging.debug('Evicted cached songs for station {}'.format(station_id))
@@ -29,6 +29,8 @@ class PithosPlugin(GObject.Object):
     _PITHOS_PLUGIN = True # used to find the plugin class in a module
     preference = None
     description = ""
+    # Whether the plugin shows Song.artUrl, full size art is only fetched for those.
+    uses_art_url = False
 
     def __init__(self, name, window, bus):
         super().__init__()
@@ -59,6 +61,8 @@ class PithosPlugin(GObject.Object):
         logging.info('Enabling module {}'.format(self.name))
         self.on_enable()
         self.enabled = True
+        if self.uses_art_url:
+            self.window.get_full_album_art()
 
     def disable(self):
         if self.enabled:
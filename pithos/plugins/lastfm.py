@@ -17,7 +17,7 @@ import logging
 
 from gi.repository import Gtk, GObject
 
-from pithos.gobject_worker import GObjectWorker
+from pithos.gobject_worker import GObjectWorker, Priority
 from pithos.plugin import PithosPlugin
 from pithos.util import open_browser
 
@@ -41,7 +41,7 @@ class LastfmPlugin(PithosPlugin):
             self.prepare_complete(error=_('pylast not found'))
         else:
             self.pylast = pylast
-            self.worker = GObjectWorker()
+            self.worker = GObjectWorker.get_default()
             self.preferences_dialog = LastFmAuth(self.pylast, self.settings)
             self.preferences_dialog.connect('lastfm-authorized', self.on_lastfm_authorized)
             self.window.prefs_dlg.connect('login-changed', self._show_dialog)
@@ -182,7 +182,8 @@ class LastfmPlugin(PithosPlugin):
         def success(*ignore):
             logging.debug('Updated Last.fm now playing. {} by {}'.format(song.title, song.artist))
 
-        self.worker.send(self.network.update_now_playing, (song.artist, song.title, song.album), success, err)
+        self.worker.send(self.network.update_now_playing, (song.artist, song.title, song.album), success, err,
+                         Priority.BACKGROUND)
 
     def _on_song_ended(self, window, song):
         def err(e):
@@ -204,7 +205,7 @@ class LastfmPlugin(PithosPlugin):
                 int(duration),
             )
 
-            self.worker.send(self.network.scrobble, args, success, err)
+            self.worker.send(self.network.scrobble, args, success, err, Priority.BACKGROUND)
 
 
 class LastFmAuth(Gtk.Dialog):
@@ -225,7 +226,7 @@ class LastFmAuth(Gtk.Dialog):
         self.set_resizable(False)
         self.connect('delete-event', self.on_close)
 
-        self.worker = GObjectWorker()
+        self.worker = GObjectWorker.get_default()
         self.settings = settings
         self.pylast = pylast
         self.auth_url = ''
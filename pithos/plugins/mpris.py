@@ -39,6 +39,7 @@ from pithos.plugin import PithosPlugin
 class MprisPlugin(PithosPlugin):
     preference = 'enable_mpris'
     description = 'Control with external programs'
+    uses_art_url = True
 
     def on_prepare(self):
         if self.bus is None:
@@ -95,6 +96,8 @@ class PithosMprisService(DBusServiceObject):
         self._metadata = self.NO_TRACK_METADATA
         self._metadata_list = [self.NO_TRACK_METADATA]
         self._tracks = [self.NO_TRACK_OBJ_PATH]
+        # The songs of _tracks, None for NO_TRACK_OBJ_PATH
+        self._track_songs = [None]
         self._playback_status = 'Stopped'
         self._playlists = [('/', '', '')]
         self._current_playlist = False, ('/', '', '')
@@ -363,10 +366,15 @@ class PithosMprisService(DBusServiceObject):
 
     def _songs_added_handler(self, window, song_count):
         '''Adds songs to the TrackList Interface.'''
+        # The current song and every song queued after it.
         songs_model = window.songs_model
-        stop = len(songs_model)
-        start = max(0, stop - (song_count + 1))
-        songs = [songs_model[i][0] for i in range(start, stop)]
+        start = window.current_song_index
+        if start is None:
+            start = max(0, len(songs_model) - song_count)
+        songs = [songs_model[i][0] for i in range(start, len(songs_model))]
+        if not songs:
+            return
+        self._track_songs = songs
         self._tracks = [self._track_id_from_song(song) for song in songs]
         self._metadata_list = [self._get_metadata(window, song) for song in songs]
         self.TrackListReplaced(self._tracks, self._tracks[0])
@@ -374,7 +382,7 @@ class PithosMprisService(DBusServiceObject):
     def _metadatachange_handler(self, window, song):
         '''Updates the metadata for the Player and TrackList Interfaces.'''
         # Ignore songs that have no chance of being in our Tracks list.
-        if song.index < max(0, len(window.songs_model) - 5):
+        if song.index is None or (window.current_song_index is not None and song.index < window.current_song_index):
             return
         metadata = self._get_metadata(window, song)
         trackId = self._track_id_from_song(song)
@@ -438,13 +446,11 @@ class PithosMprisService(DBusServiceObject):
             return
         if self.window.current_song_index is None:
             return
+        song = self._track_songs[self._tracks.index(TrackId)]
+        # The song list may have changed since the TrackList was built.
         songs_model = self.window.songs_model
-        stop = len(songs_model)
-        start = max(0, stop - 5)
-        for i in range(start, stop):
-            song = songs_model[i][0]
-            if TrackId == self._track_id_from_song(song):
-                return song
+        if song and song.index is not None and song.index < len(songs_model) and songs_model[song.index][0] is song:
+            return song
 
     def _track_id_from_song(self, song):
         '''Convenience method that generates a TrackId based on a song.'''
@@ -23,6 +23,7 @@ from pithos.util import is_flatpak
 class NotifyPlugin(PithosPlugin):
     preference = 'notify'
     description = 'Shows notifications on song change'
+    uses_art_url = True
 
     _app = None
     _app_id = None
@@ -0,0 +1,35 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def evict_song_history(songs_model, current_index, history):
+    """Removes played songs beyond history from songs_model, returns them
+
+    songs_model is a Gtk.ListStore with a Song in the first column of each
+    row and current_index the row of the current song, which moves up by
+    the number of songs returned. Songs left in the model are renumbered so
+    Song.index stays the row of the song. Evicted songs get an index of None
+    and lose their art.
+    """
+    count = current_index - history
+    if count <= 0:
+        return []
+
+    evicted = [songs_model[i][0] for i in range(count)]
+    for song in evicted:
+        song.index = None
+        song.art_pixbuf = None
+        songs_model.remove(songs_model.get_iter_first())
+    for row in songs_model:
+        row[0].index -= count
+    return evicted
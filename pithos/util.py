@@ -13,8 +13,12 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
 import logging
 import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 from urllib.parse import splittype, splituser, splitpasswd
 
 import gi
@@ -34,6 +38,13 @@ class _SecretService:
         {'email': Secret.SchemaAttributeType.STRING},
     )
 
+    # Pandora auth tokens of the last login, see PithosWindow.save_session()
+    _session_schema = Secret.Schema.new(
+        'io.github.Pithos.Session',
+        Secret.SchemaFlags.NONE,
+        {'email': Secret.SchemaAttributeType.STRING},
+    )
+
     def __init__(self):
         self._current_collection = Secret.COLLECTION_DEFAULT
 
@@ -195,10 +206,164 @@ class _SecretService:
                 None,
             )
 
+    def get_session(self, email, callback):
+        def on_session_lookup_finish(_, result):
+            try:
+                session = Secret.password_lookup_finish(result)
+            except GLib.Error as e:
+                logging.error('Failed to lookup session async, Error: {}'.format(e))
+                session = None
+            callback(session)
+
+        # See get_account_password()
+        if is_flatpak():
+            try:
+                session = Secret.password_lookup_sync(
+                    self._session_schema,
+                    {'email': email},
+                    None,
+                )
+            except GLib.Error as e:
+                logging.error('Failed to lookup session sync, Error: {}'.format(e))
+                session = None
+            callback(session)
+            return
+
+        Secret.password_lookup(
+            self._session_schema,
+            {'email': email},
+            None,
+            on_session_lookup_finish,
+        )
+
+    def set_session(self, email, session):
+        def on_session_store_finish(source, result, data):
+            try:
+                Secret.password_store_finish(result)
+            except GLib.Error as e:
+                logging.error('Failed to store session, Error: {}'.format(e))
+
+        Secret.password_store(
+            self._session_schema,
+            {'email': email},
+            self._current_collection,
+            'Pandora Session',
+            session,
+            None,
+            on_session_store_finish,
+            None,
+        )
+
 
 SecretService = _SecretService()
 
 
+class JsonFileCache:
+    """A small mapping persisted as a JSON file
+
+    Entries are kept in insertion order and the oldest ones are dropped
+    once there are more than max_entries. Changes are only written to
+    disk by :py:meth:`save`.
+    """
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning('Failed to load cache {}: {}'.format(path, e))
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def items(self):
+        """Returns a list of (key, value), oldest first"""
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def save(self):
+        with self._lock:
+            text = json.dumps(self._data)
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning('Failed to save cache {}: {}'.format(self.path, e))
+
+
+class BandwidthMeter:
+    """Counts bytes transferred by category, e.g. 'audio', 'art' and 'api'
+
+    Bytes are kept in per minute buckets for the last hour, so
+    :py:meth:`per_hour` is a running total. This is thread-safe.
+    """
+
+    BUCKET = 60
+    WINDOW = 60*60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (bucket start, Counter of bytes by category), oldest first
+        self._buckets = deque()
+        self.totals = Counter()
+
+    def add(self, category, size, now=None):
+        if not size:
+            return
+        now = time.monotonic() if now is None else now
+        start = now - now % self.BUCKET
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != start:
+                self._buckets.append((start, Counter()))
+            self._buckets[-1][1][category] += size
+            self.totals[category] += size
+            self._expire(now)
+
+    def per_hour(self, now=None):
+        """Returns a Counter of the bytes by category transferred in the last hour"""
+        now = time.monotonic() if now is None else now
+        total = Counter()
+        with self._lock:
+            self._expire(now)
+            for start, counts in self._buckets:
+                total.update(counts)
+        return total
+
+    def _expire(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.WINDOW:
+            self._buckets.popleft()
+
+
 def parse_proxy(proxy):
     """ _parse_proxy from urllib """
     scheme, r_scheme = splittype(proxy)